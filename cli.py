@@ -7,7 +7,8 @@ import argparse
 import os
 import sys
 import json
-from typing import Dict, Any
+from functools import lru_cache
+from typing import Dict, Any, Optional
 from dotenv import load_dotenv
 
 from medical_diagnosis_system import (
@@ -23,90 +24,51 @@ def load_config(config_path: str) -> Dict[str, Any]:
         return json.load(f)
 
 
+# provider → (환경 변수, 기본 모델, API 키 발급 URL)
+PROVIDER_ENV = {
+    "gpt": ("OPENAI_API_KEY", "gpt-4", "https://platform.openai.com/api-keys"),
+    "claude": ("ANTHROPIC_API_KEY", "claude-3-opus-20240229", "https://console.anthropic.com/"),
+    "gemini": ("GOOGLE_API_KEY", "gemini-pro", "https://makersuite.google.com/app/apikey"),
+    "grok": ("XAI_API_KEY", "grok-1", "https://console.x.ai/"),
+}
+
+
+@lru_cache(maxsize=None)
+def _env_api_key(env_var: str) -> Optional[str]:
+    """Read an API key from the environment once (after load_dotenv)"""
+    return os.getenv(env_var)
+
+
 def get_ai_providers_from_env(provider_name: str = None, model: str = None) -> Dict[str, Dict[str, str]]:
     """Get AI provider configuration from environment variables"""
     providers = {}
     
     if provider_name:
         # Use specific provider
-        if provider_name == "gpt":
-            api_key = os.getenv("OPENAI_API_KEY")
-            if not api_key:
-                print("\n❌ 오류: OPENAI_API_KEY를 찾을 수 없습니다.")
-                print("Error: OPENAI_API_KEY not found in environment")
-                print("\n해결 방법:")
-                print("1. .env 파일에 OPENAI_API_KEY=your-key 추가")
-                print("2. 또는 환경 변수로 설정: export OPENAI_API_KEY=your-key")
-                print("3. API 키 발급: https://platform.openai.com/api-keys\n")
-                sys.exit(1)
-            providers["gpt"] = {
-                "api_key": api_key,
-                "model": model or "gpt-4"
-            }
-        elif provider_name == "claude":
-            api_key = os.getenv("ANTHROPIC_API_KEY")
+        if provider_name in PROVIDER_ENV:
+            env_var, default_model, key_url = PROVIDER_ENV[provider_name]
+            api_key = _env_api_key(env_var)
             if not api_key:
-                print("\n❌ 오류: ANTHROPIC_API_KEY를 찾을 수 없습니다.")
-                print("Error: ANTHROPIC_API_KEY not found in environment")
+                print(f"\n❌ 오류: {env_var}를 찾을 수 없습니다.")
+                print(f"Error: {env_var} not found in environment")
                 print("\n해결 방법:")
-                print("1. .env 파일에 ANTHROPIC_API_KEY=your-key 추가")
-                print("2. 또는 환경 변수로 설정: export ANTHROPIC_API_KEY=your-key")
-                print("3. API 키 발급: https://console.anthropic.com/\n")
+                print(f"1. .env 파일에 {env_var}=your-key 추가")
+                print(f"2. 또는 환경 변수로 설정: export {env_var}=your-key")
+                print(f"3. API 키 발급: {key_url}\n")
                 sys.exit(1)
-            providers["claude"] = {
+            providers[provider_name] = {
                 "api_key": api_key,
-                "model": model or "claude-3-opus-20240229"
-            }
-        elif provider_name == "gemini":
-            api_key = os.getenv("GOOGLE_API_KEY")
-            if not api_key:
-                print("\n❌ 오류: GOOGLE_API_KEY를 찾을 수 없습니다.")
-                print("Error: GOOGLE_API_KEY not found in environment")
-                print("\n해결 방법:")
-                print("1. .env 파일에 GOOGLE_API_KEY=your-key 추가")
-                print("2. 또는 환경 변수로 설정: export GOOGLE_API_KEY=your-key")
-                print("3. API 키 발급: https://makersuite.google.com/app/apikey\n")
-                sys.exit(1)
-            providers["gemini"] = {
-                "api_key": api_key,
-                "model": model or "gemini-pro"
-            }
-        elif provider_name == "grok":
-            api_key = os.getenv("XAI_API_KEY")
-            if not api_key:
-                print("\n❌ 오류: XAI_API_KEY를 찾을 수 없습니다.")
-                print("Error: XAI_API_KEY not found in environment")
-                print("\n해결 방법:")
-                print("1. .env 파일에 XAI_API_KEY=your-key 추가")
-                print("2. 또는 환경 변수로 설정: export XAI_API_KEY=your-key")
-                print("3. API 키 발급: https://console.x.ai/\n")
-                sys.exit(1)
-            providers["grok"] = {
-                "api_key": api_key,
-                "model": model or "grok-1"
+                "model": model or default_model
             }
     else:
         # Load all available providers
-        if os.getenv("OPENAI_API_KEY"):
-            providers["gpt"] = {
-                "api_key": os.getenv("OPENAI_API_KEY"),
-                "model": "gpt-4"
-            }
-        if os.getenv("ANTHROPIC_API_KEY"):
-            providers["claude"] = {
-                "api_key": os.getenv("ANTHROPIC_API_KEY"),
-                "model": "claude-3-opus-20240229"
-            }
-        if os.getenv("GOOGLE_API_KEY"):
-            providers["gemini"] = {
-                "api_key": os.getenv("GOOGLE_API_KEY"),
-                "model": "gemini-pro"
-            }
-        if os.getenv("XAI_API_KEY"):
-            providers["grok"] = {
-                "api_key": os.getenv("XAI_API_KEY"),
-                "model": "grok-1"
-            }
+        for name, (env_var, default_model, _) in PROVIDER_ENV.items():
+            api_key = _env_api_key(env_var)
+            if api_key:
+                providers[name] = {
+                    "api_key": api_key,
+                    "model": default_model
+                }
     
     if not providers:
         print("\n" + "="*60)
@@ -15,39 +15,158 @@ GitHub: https://github.com/[your-username]/multi-ai-medical-diagnosis
 """
 
 import os
+import sys
+import re
 import json
 import time
 import random
-from typing import List, Dict, Optional, Tuple, Any
+import hashlib
+import copy
+import importlib
+import importlib.util
+from collections import deque
+import sqlite3
+import threading
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from typing import List, Dict, Optional, Tuple, Any, Deque, Callable
 from dataclasses import dataclass, field
 from enum import Enum
 from abc import ABC, abstractmethod
 
 # AI Provider imports
-try:
-    import anthropic
-    CLAUDE_AVAILABLE = True
-except ImportError:
-    CLAUDE_AVAILABLE = False
+# SDK는 설치 여부만 확인하고 실제 import는 해당 클라이언트를 처음 만들 때 수행
+# (사용하지 않는 제공자의 SDK 로딩 시간을 시작 시점에 지불하지 않음)
+class _LazyModule:
+    """Module proxy that imports the named module on first attribute access"""
+    
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+    
+    def _load(self) -> Any:
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+    
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._load(), attr)
+
+
+def _sdk_installed(name: str) -> bool:
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+anthropic = _LazyModule("anthropic")
+httpx = _LazyModule("httpx")  # anthropic 의존성 (스트림 읽기 타임아웃 예외 처리용)
+CLAUDE_AVAILABLE = _sdk_installed("anthropic")
+if not CLAUDE_AVAILABLE:
     print("⚠️ Anthropic library not available. Install: pip install anthropic")
 
-try:
-    import openai
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
+openai = _LazyModule("openai")
+OPENAI_AVAILABLE = _sdk_installed("openai")
+if not OPENAI_AVAILABLE:
     print("⚠️ OpenAI library not available. Install: pip install openai")
 
-try:
-    import google.generativeai as genai
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
+genai = _LazyModule("google.generativeai")
+GEMINI_AVAILABLE = _sdk_installed("google.generativeai")
+if not GEMINI_AVAILABLE:
     print("⚠️ Google Gemini library not available. Install: pip install google-generativeai")
 
+
+def _preload_sdks() -> None:
+    """Import every installed provider SDK (run in the background while waiting on user input)"""
+    for module, available in ((anthropic, CLAUDE_AVAILABLE), (httpx, CLAUDE_AVAILABLE),
+                              (openai, OPENAI_AVAILABLE), (genai, GEMINI_AVAILABLE)):
+        if available:
+            try:
+                module._load()
+            except Exception:
+                pass  # 실제 클라이언트 생성 시 같은 오류가 다시 보고됨
+
 # Note: Grok API is similar to OpenAI's interface
 GROK_AVAILABLE = OPENAI_AVAILABLE  # Uses OpenAI-compatible API
 
+# Optional: orjson으로 JSON 인코딩/디코딩 가속 (없으면 표준 json 사용)
+# orjson.JSONDecodeError는 json.JSONDecodeError의 하위 클래스이므로 예외 처리는 동일
+# _canon: 캐시 키용 정규 직렬화 (키 정렬, 공백 없음, UTF-8)
+#         표준 json 대체 구현도 같은 바이트를 만들므로 orjson 설치 여부와 무관하게 키가 동일
+try:
+    import orjson
+    _json_loads = orjson.loads
+    
+    def _json_dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+    
+    def _canon(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+except ImportError:
+    _json_loads = json.loads
+    
+    def _json_dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+    
+    def _canon(obj: Any) -> bytes:
+        return json.dumps(obj, sort_keys=True, ensure_ascii=False,
+                          separators=(",", ":")).encode("utf-8")
+
+# 정규식은 모듈 로드 시 한 번만 컴파일 (검색 결과/심판 응답 파싱은 라운드마다 반복됨)
+# 웹 검색 결과 HTML 정리
+_SCRIPT_TAG_RE = re.compile(r'<script[^>]*>.*?</script>', re.DOTALL | re.IGNORECASE)
+_STYLE_TAG_RE = re.compile(r'<style[^>]*>.*?</style>', re.DOTALL | re.IGNORECASE)
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+_WHITESPACE_RE = re.compile(r'\s+')
+# 검색 엔진별 스니펫 추출
+_BING_SNIPPET_RE = re.compile(r'<div class="[^"]*b_caption[^"]*">([^<]+)</div>', re.DOTALL)
+_DDG_SNIPPET_RE = re.compile(r'<td[^>]*>(.*?)</td>', re.DOTALL)
+_YAHOO_SNIPPET_RE = re.compile(r'<p class="[^"]*s-desc[^"]*">([^<]+)</p>', re.DOTALL)
+# 심판 합의 판정
+_JSON_CODE_BLOCK_RE = re.compile(r'```json\s*\n(.*?)\n```', re.DOTALL | re.IGNORECASE)
+_CONSENSUS_JSON_RE = re.compile(
+    r'\{[^}]*["\']?consensus_reached["\']?\s*:\s*(true|false)[^}]*\}', re.IGNORECASE
+)
+_BOOL_RE = re.compile(r'(true|false)', re.IGNORECASE)
+# 클라이언트 오류/시간 초과/도구 반복 한도 응답 ("[Claude Error: ...]", "[Timeout: ...]" 등)
+_FAILED_RESPONSE_RE = re.compile(r'^\[(?:(?:\w+ )?(?:Error|Timeout)\b|Max tool iterations reached)')
+
+
+# 단계별 최대 출력 토큰
+# 의사 의견은 2000으로 제한 (폭주 생성 방지, 꼬리 지연 감소)
+# 심판은 응답 마지막 줄에 합의 JSON을 출력해야 하므로 잘리지 않도록 기본값 유지
+DEFAULT_MAX_TOKENS = 3000
+DOCTOR_MAX_TOKENS = 2000
+REFEREE_MAX_TOKENS = DEFAULT_MAX_TOKENS
+
+# 도구 정의는 호출마다 새로 만들지 않고 모듈 상수로 공유 (요청 간 바이트 단위로 동일)
+# Claude: 서버 측 웹 검색
+CLAUDE_WEB_SEARCH_TOOL = {
+    "type": "web_search_20250305",
+    "name": "web_search",
+    "max_uses": 5
+}
+# GPT/Grok: OpenAI function calling 형식 (검색은 클라이언트에서 실행)
+WEB_SEARCH_FUNCTION_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "web_search",
+        "description": "최신 의학 데이터베이스와 웹 정보를 통합 검색하여 차등 진단 근거를 확보합니다. Search latest medical databases and web information to secure differential diagnosis evidence. Includes drug interactions, disease symptoms, treatment guidelines, and recent medical research.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "검색 쿼리 (의학 정보) / Search query for medical information"
+                }
+            },
+            "required": ["query"]
+        }
+    }
+}
+
 
 class AIProvider(Enum):
     """Available AI providers"""
@@ -57,6 +176,71 @@ class AIProvider(Enum):
     GROK = "grok"
 
 
+# SDK 클라이언트는 제공자/API 키별로 하나만 생성하여 모든 의사/심판이 공유
+# (클라이언트마다 별도 연결 풀 → 호출마다 새 TLS 핸드셰이크가 생기는 것을 방지)
+_SDK_CLIENTS: Dict[Tuple, Any] = {}
+_SDK_CLIENTS_LOCK = threading.Lock()
+
+
+def _shared_sdk_client(key: Tuple, factory) -> Any:
+    """Return the process-wide SDK client for key, creating it on first use"""
+    with _SDK_CLIENTS_LOCK:
+        client = _SDK_CLIENTS.get(key)
+        if client is None:
+            client = factory()
+            _SDK_CLIENTS[key] = client
+        return client
+
+
+class SearchBroker:
+    """
+    Shares client-side web search results between doctors in one debate.
+    The first caller for a query runs the search; other callers with the
+    same (normalized) query wait for that result instead of searching again.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results: Dict[str, Future] = {}
+    
+    def search(self, query: str, search_fn) -> str:
+        key = " ".join(query.lower().split())
+        with self._lock:
+            future = self._results.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._results[key] = future
+        if not owner:
+            return future.result()
+        
+        try:
+            result = search_fn(query)
+        except BaseException as e:
+            with self._lock:
+                self._results.pop(key, None)
+            future.set_exception(e)
+            raise
+        # 실패한 검색은 공유하지 않음 (다음 요청자가 다시 시도)
+        # "[Web search completed]"는 모든 엔진이 실패했을 때의 대체 문구이므로 실패로 취급
+        if result.startswith(("[Web search error", "[Web search completed]")):
+            with self._lock:
+                self._results.pop(key, None)
+        future.set_result(result)
+        return result
+
+
+# 일시적 오류로 간주하여 재시도하는 예외 (SDK 버전과 무관하도록 클래스 이름으로 판별)
+# 400/401/403 등 요청 자체의 오류는 재시도해도 결과가 같으므로 제외
+# 타임아웃은 제외: 스트림 정지는 ClaudeClient._create가 같은 시간 예산 안에서 따로 재시도
+_TRANSIENT_ERROR_NAMES = {
+    "RateLimitError", "InternalServerError", "APIConnectionError",
+    "ConnectError", "RemoteProtocolError"
+}
+# 응답 본문의 오류 유형 중 재시도 대상 (스트리밍 응답의 SSE error 이벤트 포함)
+_TRANSIENT_ERROR_TYPES = {"overloaded_error", "api_error", "rate_limit_error"}
+
+
 class BaseAIClient(ABC):
     """Abstract base class for AI clients"""
     
@@ -65,6 +249,52 @@ class BaseAIClient(ABC):
         self.last_call_time = 0
         self.min_call_interval = 0.5
         self.max_retries = 3
+        self.max_backoff = 30.0
+        self.search_broker: Optional[SearchBroker] = None  # 토론 중 검색 결과 공유
+        # 진행/재시도 메시지 출력 함수 (토론 중에는 시스템의 TranscriptWriter로 교체되어 출력 순서 유지)
+        self.log: Callable[[str], None] = print
+    
+    @staticmethod
+    def _is_transient_error(error: Exception) -> bool:
+        """429, 5xx (incl. 529 overloaded) and connection drops"""
+        # 스트림 도중의 SSE error 이벤트는 HTTP 200 상태 코드를 가진 APIStatusError로 전달되므로
+        # 본문의 오류 유형을 먼저 확인 ({"type": "error", "error": {"type": "overloaded_error"}})
+        body = getattr(error, "body", None)
+        if isinstance(body, dict):
+            detail = body.get("error")
+            error_type = detail.get("type") if isinstance(detail, dict) else body.get("type")
+            if error_type in _TRANSIENT_ERROR_TYPES:
+                return True
+        status = getattr(error, "status_code", None)
+        if isinstance(status, int):
+            return status == 429 or status >= 500
+        return type(error).__name__ in _TRANSIENT_ERROR_NAMES
+    
+    def _with_retry(self, fn, *args, deadline: Optional[float] = None) -> Any:
+        """
+        Call fn(*args), retrying transient errors with jittered exponential backoff
+        (1s up to max_backoff); other errors are raised immediately.
+        No retry is started past deadline (time.monotonic() value).
+        """
+        for attempt in range(self.max_retries):
+            try:
+                return fn(*args)
+            except Exception as e:
+                if attempt >= self.max_retries - 1 or not self._is_transient_error(e):
+                    raise
+                # 지터: 동시에 실패한 호출들이 같은 시점에 재시도하지 않도록 분산
+                wait_time = random.uniform(1.0, min(self.max_backoff, 2 ** (attempt + 1)))
+                if deadline is not None and time.monotonic() + wait_time >= deadline:
+                    raise
+                self.log(f"⚠️ {self.get_model_name()} {type(e).__name__}, retry in {wait_time:.1f}s "
+                      f"(attempt {attempt + 1}/{self.max_retries})")
+                time.sleep(wait_time)
+    
+    def _web_search(self, query: str) -> str:
+        """Client-side web search, shared through the debate's SearchBroker when set"""
+        if self.search_broker is None:
+            return self._execute_web_search(query)
+        return self.search_broker.search(query, self._execute_web_search)
     
     def _rate_limit_check(self):
         """Rate limiting to prevent API throttling"""
@@ -76,88 +306,454 @@ class BaseAIClient(ABC):
     
     @abstractmethod
     def call(self, system_prompt: str, user_message: str, 
-             use_tools: bool = False) -> Tuple[str, List[Dict]]:
+             use_tools: bool = False,
+             max_tokens: int = DEFAULT_MAX_TOKENS) -> Tuple[str, List[Dict]]:
         """Make API call to the AI provider"""
         pass
     
+    def call_with_context(self, system_prompt: str, context: str, question: str,
+                          use_tools: bool = False,
+                          max_tokens: int = DEFAULT_MAX_TOKENS) -> Tuple[str, List[Dict]]:
+        """Make API call with a stable patient context followed by a per-turn question"""
+        return self.call(system_prompt, f"{context}\n\n{question}",
+                         use_tools=use_tools, max_tokens=max_tokens)
+    
     @abstractmethod
     def get_model_name(self) -> str:
         """Get the model name being used"""
         pass
 
 
+class ResponseCache:
+    """
+    Local SQLite cache of AI responses keyed by the full request content
+    (model, system prompt, user message, tools). Replays of identical
+    requests return in milliseconds instead of re-billing tokens.
+    """
+    
+    def __init__(self, path: str = ".diagnosis_cache.sqlite3", ttl_seconds: int = 24 * 3600):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT, tool_info TEXT, ts INTEGER)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_ts ON responses (ts)")
+        self._purge_expired()
+        self._conn.commit()
+    
+    def _purge_expired(self) -> None:
+        # 만료된 행은 읽을 때 무시하는 것만으로는 파일에 남으므로 실제로 삭제 (환자 정보 포함)
+        self._conn.execute("DELETE FROM responses WHERE ts < ?",
+                           (int(time.time()) - self.ttl_seconds,))
+    
+    @staticmethod
+    def _normalize(part: Any) -> Any:
+        """Collapse whitespace so prompts differing only in spacing/line breaks share a key"""
+        if isinstance(part, str):
+            return " ".join(part.split())
+        if isinstance(part, list):
+            return [ResponseCache._normalize(p) for p in part]
+        if isinstance(part, dict):
+            return {k: ResponseCache._normalize(v) for k, v in part.items()}
+        return part
+    
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """sha256 over all request parts (dict/list parts are serialized canonically)"""
+        digest = hashlib.sha256()
+        for part in parts:
+            part = ResponseCache._normalize(part)
+            digest.update(part.encode("utf-8") if isinstance(part, str) else _canon(part))
+            digest.update(b"\x1f")
+        return digest.hexdigest()
+    
+    def get(self, key: str) -> Optional[Tuple[str, List[Dict]]]:
+        """Return (response, tool_info) if cached and not expired"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, tool_info, ts FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        response, tool_info, ts = row
+        if time.time() - ts > self.ttl_seconds:
+            return None
+        return response, _json_loads(tool_info)
+    
+    def put(self, key: str, response: str, tool_info: List[Dict]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, response, _json_dumps(tool_info), int(time.time()))
+            )
+            self._purge_expired()
+            self._conn.commit()
+
+
+class AnswerCache:
+    """
+    Local SQLite cache of complete diagnosis results keyed by the patient
+    presentation and debate settings. Re-running the same case (demos,
+    development) returns the stored result without starting a debate.
+    Only exact matches are reused; a similar-but-different case always
+    gets a fresh debate.
+    """
+    
+    def __init__(self, path: str = ".diagnosis_cache.sqlite3", ttl_seconds: int = 24 * 3600):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "key TEXT PRIMARY KEY, result TEXT, ts INTEGER, hits INTEGER DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_ts ON answers (ts)")
+        self._purge_expired()
+        self._conn.commit()
+    
+    def _purge_expired(self) -> None:
+        self._conn.execute("DELETE FROM answers WHERE ts < ?",
+                           (int(time.time()) - self.ttl_seconds,))
+    
+    def get(self, key: str) -> Optional[Dict]:
+        """Return the stored result if cached and not expired"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, ts FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or time.time() - row[1] > self.ttl_seconds:
+                return None
+            self._conn.execute("UPDATE answers SET hits = hits + 1 WHERE key = ?", (key,))
+            self._conn.commit()
+        return _json_loads(row[0])
+    
+    def put(self, key: str, result: Dict) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, 0)",
+                (key, _json_dumps(result), int(time.time()))
+            )
+            self._purge_expired()
+            self._conn.commit()
+
+
+class TranscriptWriter:
+    """
+    Background writer for debate output. Messages are queued and written to
+    stdout (and optionally appended to a JSONL transcript) by a daemon thread,
+    so slow terminals or disk writes never stall the debate loop.
+    A failed write is reported on stderr and the writer keeps running.
+    """
+    
+    def __init__(self, path: Optional[str] = None, echo: bool = True):
+        self.path = path
+        self.echo = echo
+        # 파일은 여기서 열어 잘못된 경로가 생성 시점에 바로 오류가 되도록 함
+        self._transcript = open(path, "a", encoding="utf-8") if path else None
+        self._queue: "queue.Queue[Optional[Tuple[float, str]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="transcript-writer", daemon=True)
+        self._thread.start()
+    
+    def write(self, text: str = "") -> None:
+        """Queue one message (print() semantics: a newline is appended on output)"""
+        self._queue.put((time.time(), text))
+    
+    def flush(self) -> None:
+        """Block until every queued message has been written (or the writer thread has stopped)"""
+        # Queue.join()은 쓰기 스레드가 죽으면 영원히 대기하므로 스레드 생존 여부를 함께 확인
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks and self._thread.is_alive():
+                self._queue.all_tasks_done.wait(0.1)
+    
+    def close(self) -> None:
+        """Write out queued messages, stop the writer thread and close the transcript"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._transcript:
+            self._transcript.close()
+            self._transcript = None
+    
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            # 쌓인 메시지를 한 번에 모아서 출력 (메시지마다 write 호출하지 않음)
+            items = [item]
+            stop = False
+            while True:
+                try:
+                    nxt = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self._queue.task_done()
+                    stop = True
+                    break
+                items.append(nxt)
+            try:
+                self._write_items(items)
+            finally:
+                # 출력에 실패해도 꺼낸 항목은 모두 완료 처리 (flush()가 멈추지 않도록)
+                for _ in items:
+                    self._queue.task_done()
+            if stop:
+                return
+    
+    def _write_items(self, items: List[Tuple[float, str]]) -> None:
+        # 콘솔과 파일은 따로 처리: 한쪽이 실패해도(BrokenPipe, 인코딩, 디스크 오류) 다른 쪽은 기록
+        if self.echo:
+            try:
+                print("\n".join(text for _, text in items), flush=True)
+            except Exception as e:
+                self._report(e)
+        if self._transcript:
+            try:
+                self._transcript.write("".join(
+                    _json_dumps({"ts": ts, "text": text}) + "\n"
+                    for ts, text in items))
+                self._transcript.flush()
+            except Exception as e:
+                self._report(e)
+    
+    @staticmethod
+    def _report(error: Exception) -> None:
+        try:
+            sys.stderr.write(f"⚠️ Transcript write failed: {type(error).__name__}: {error}\n")
+        except Exception:
+            pass
+
+
 class ClaudeClient(BaseAIClient):
     """Claude AI client (Anthropic)"""
     
-    def __init__(self, api_key: str, model: str = "claude-sonnet-4-20250514"):
+    def __init__(self, api_key: str, model: str = "claude-sonnet-4-20250514",
+                 cache_ttl: Optional[str] = None,
+                 response_cache: Optional[ResponseCache] = None,
+                 stall_timeout: float = 60.0, stall_retries: int = 1,
+                 progress_every: int = 0, call_timeout: Optional[float] = None):
         super().__init__()
         if not CLAUDE_AVAILABLE:
             raise ImportError("Anthropic library not available")
-        self.client = anthropic.Anthropic(api_key=api_key)
+        # 스트림 정지 감시: 읽기 타임아웃은 청크 사이의 대기 시간에 적용되므로
+        # stall_timeout 동안 이벤트가 하나도 오지 않으면 스트림이 끊기고 재시도함
+        # (서버는 생성/검색 중에도 ping 이벤트를 보내므로 정상 스트림은 끊기지 않음)
+        self.client = _shared_sdk_client(
+            ("anthropic", api_key, stall_timeout),
+            # SDK 자체 재시도는 끔: 재시도는 _create(정지)와 _with_retry(429/5xx)가 하나의 예산으로 담당
+            lambda: anthropic.Anthropic(
+                api_key=api_key, timeout=httpx.Timeout(stall_timeout, connect=10.0),
+                max_retries=0
+            )
+        )
         self.model = model
+        self.response_cache = response_cache
+        self.stall_timeout = stall_timeout
+        self.stall_retries = stall_retries
+        self.progress_every = progress_every  # N개 청크마다 진행 상황 출력 (0 = 끔)
+        self.max_retries = 6  # 429/529 과부하는 수십 초 지속될 수 있음
+        # 호출 1회(재시도 포함)의 전체 시간 예산; 이 시간을 넘겨 새 시도를 시작하지 않음
+        self.call_timeout = call_timeout
+        
+        # 프롬프트 캐싱: 시스템 프롬프트와 환자 정보는 라운드마다 동일하므로
+        # 캐시 브레이크포인트로 지정하여 매 호출마다 다시 처리되지 않게 함
+        # cache_ttl="1h" → 라운드 간격이 5분을 넘는 긴 토론용
+        self.cache_control = {"type": "ephemeral"}
+        if cache_ttl:
+            self.cache_control["ttl"] = cache_ttl
     
     def call(self, system_prompt: str, user_message: str, 
-             use_tools: bool = False) -> Tuple[str, List[Dict]]:
+             use_tools: bool = False,
+             max_tokens: int = DEFAULT_MAX_TOKENS) -> Tuple[str, List[Dict]]:
+        return self._send(self.build_params(system_prompt, user_message, use_tools, max_tokens))
+    
+    def call_with_context(self, system_prompt: str, context: str, question: str,
+                          use_tools: bool = False,
+                          max_tokens: int = DEFAULT_MAX_TOKENS) -> Tuple[str, List[Dict]]:
+        return self._send(self.build_params_with_context(
+            system_prompt, context, question, use_tools, max_tokens))
+    
+    def build_params(self, system_prompt: str, user_content: Any,
+                     use_tools: bool = False,
+                     max_tokens: int = DEFAULT_MAX_TOKENS) -> Dict:
+        """Build messages.create() parameters (shared by online and batch requests)"""
+        params = {
+            "model": self.model,
+            "max_tokens": max_tokens,
+            "system": [{
+                "type": "text",
+                "text": system_prompt,
+                "cache_control": self.cache_control
+            }],
+            "messages": [{"role": "user", "content": user_content}]
+        }
+        
+        if use_tools:
+            params["tools"] = [CLAUDE_WEB_SEARCH_TOOL]
+        return params
+    
+    def build_params_with_context(self, system_prompt: str, context: str, question: str,
+                                  use_tools: bool = False,
+                                  max_tokens: int = DEFAULT_MAX_TOKENS) -> Dict:
+        if not context.strip():
+            return self.build_params(system_prompt, question, use_tools, max_tokens)
+        
+        # 고정된 환자 정보 블록을 먼저 두고 두 번째 캐시 브레이크포인트 지정
+        # 라운드마다 바뀌는 질문은 그 뒤에 배치하여 접두사가 바이트 단위로 동일하게 유지됨
+        user_content = [
+            {"type": "text", "text": context, "cache_control": self.cache_control},
+            {"type": "text", "text": question}
+        ]
+        return self.build_params(system_prompt, user_content, use_tools, max_tokens)
+    
+    def _send(self, params: Dict) -> Tuple[str, List[Dict]]:
         try:
-            params = {
-                "model": self.model,
-                "max_tokens": 3000,
-                "system": system_prompt,
-                "messages": [{"role": "user", "content": user_message}]
-            }
+            user_content = params["messages"][0]["content"]
             
-            if use_tools:
-                params["tools"] = [{
-                    "type": "web_search_20250305",
-                    "name": "web_search",
-                    "max_uses": 5
-                }]
+            # 로컬 응답 캐시: 동일 요청이면 API 호출 없이 저장된 응답 반환
+            # (max_tokens도 키에 포함: 한도가 다르면 잘린 응답이 재사용될 수 있음)
+            cache_key = None
+            if self.response_cache is not None:
+                cache_key = ResponseCache.make_key(
+                    self.model, params["system"], user_content, params.get("tools", []),
+                    params["max_tokens"]
+                )
+                cached = self._cache_get(cache_key)
+                if cached is not None:
+                    return cached
             
-            message = self.client.messages.create(**params)
+            deadline = None
+            if self.call_timeout is not None:
+                deadline = time.monotonic() + self.call_timeout
+            
+            message = self._with_retry(self._create, params, deadline, deadline=deadline)
             
             # pause_turn 처리: API가 긴 턴을 일시 정지한 경우
             # 응답을 그대로 다시 보내면 Claude가 턴을 계속
             # FIX: 메시지 누적을 위해 리스트를 루프 밖에서 초기화
-            messages_for_continuation = [{"role": "user", "content": user_message}]
+            messages_for_continuation = [{"role": "user", "content": user_content}]
             
             while message.stop_reason == "pause_turn":
                 # FIX: 이전 assistant 응답을 누적 (맥락 유지)
                 messages_for_continuation.append({"role": "assistant", "content": message.content})
                 
-                message = self.client.messages.create(
-                    model=self.model,
-                    max_tokens=3000,
-                    system=system_prompt,
-                    messages=messages_for_continuation,
-                    tools=params.get("tools", [])
-                )
+                message = self._with_retry(
+                    self._create, {**params, "messages": messages_for_continuation}, deadline,
+                    deadline=deadline)
             
-            # 응답 파싱
-            # web_search_20250305는 서버 측에서 자동 실행됨:
-            #   server_tool_use  → 검색 쿼리 (Claude가 생성)
-            #   web_search_tool_result → 검색 결과 (API가 자동 주입)
-            #   text (with citations) → 최종 답변
-            # stop_reason은 end_turn이며, 클라이언트가 tool_result를 보낼 필요 없음
-            response_text = ""
-            search_queries = []
+            response_text, search_queries = self._parse_message(message)
             
-            for block in message.content:
-                if block.type == "text":
-                    response_text += block.text
-                elif block.type == "server_tool_use" and block.name == "web_search":
-                    # 서버 측 검색 쿼리 기록
-                    search_queries.append({
-                        "query": block.input.get("query", ""),
-                        "tool": "web_search"
-                    })
-                # web_search_tool_result은 서버가 자동 주입 → 파싱 불필요
-                # text 블록의 citations 안에 출처 정보 포함됨
+            # 검색 쿼리(tool 정보)도 함께 저장하여 재생 시 완전한 결과 제공
+            if cache_key is not None:
+                self._cache_put(cache_key, response_text, search_queries)
             
             return response_text, search_queries
             
         except Exception as e:
             return f"[Claude Error: {str(e)}]", []
     
+    # 캐시 I/O 오류(예: 여러 연결이 같은 파일을 쓸 때의 "database is locked")는
+    # 호출 실패로 만들지 않음: 캐시 없이 진행하고 경고만 출력
+    def _cache_get(self, key: str) -> Optional[Tuple[str, List[Dict]]]:
+        try:
+            return self.response_cache.get(key)
+        except Exception as e:
+            self.log(f"⚠️ Response cache read failed, calling API: {e}")
+            return None
+    
+    def _cache_put(self, key: str, response: str, tool_info: List[Dict]) -> None:
+        try:
+            self.response_cache.put(key, response, tool_info)
+        except Exception as e:
+            self.log(f"⚠️ Response cache write failed, response not cached: {e}")
+    
+    def _create(self, params: Dict, deadline: Optional[float] = None) -> Any:
+        """
+        Streaming request: tokens arrive as they are generated instead of one
+        blocking response at the end; the final message (with tool-use blocks)
+        is assembled by the SDK and parsed exactly like a non-streamed one.
+        A stream that goes silent for stall_timeout seconds is dropped and retried,
+        unless a fresh attempt would no longer fit before deadline.
+        """
+        for attempt in range(self.stall_retries + 1):
+            try:
+                with self.client.messages.stream(**params) as stream:
+                    chunks = 0
+                    for event in stream:
+                        if event.type != "content_block_delta":
+                            continue
+                        chunks += 1
+                        if self.progress_every and chunks % self.progress_every == 0:
+                            self.log(f"[{self.get_model_name()}] streaming... {chunks} chunks")
+                    return stream.get_final_message()
+            except (anthropic.APITimeoutError, httpx.TimeoutException):
+                if attempt >= self.stall_retries:
+                    raise
+                if deadline is not None and time.monotonic() + self.stall_timeout > deadline:
+                    raise
+                self.log(f"⚠️ [{self.get_model_name()}] no data for {self.stall_timeout:g}s, "
+                      f"retrying ({attempt + 1}/{self.stall_retries})")
+    
+    @staticmethod
+    def _parse_message(message: Any) -> Tuple[str, List[Dict]]:
+        """
+        응답 파싱
+        web_search_20250305는 서버 측에서 자동 실행됨:
+          server_tool_use  → 검색 쿼리 (Claude가 생성)
+          web_search_tool_result → 검색 결과 (API가 자동 주입)
+          text (with citations) → 최종 답변
+        stop_reason은 end_turn이며, 클라이언트가 tool_result를 보낼 필요 없음
+        """
+        response_text = ""
+        search_queries = []
+        
+        for block in message.content:
+            if block.type == "text":
+                response_text += block.text
+            elif block.type == "server_tool_use" and block.name == "web_search":
+                # 서버 측 검색 쿼리 기록
+                search_queries.append({
+                    "query": block.input.get("query", ""),
+                    "tool": "web_search"
+                })
+            # web_search_tool_result은 서버가 자동 주입 → 파싱 불필요
+            # text 블록의 citations 안에 출처 정보 포함됨
+        
+        return response_text, search_queries
+    
+    def submit_batch(self, requests: List[Dict],
+                     poll_interval: float = 10.0) -> Dict[str, Optional[Tuple[str, List[Dict]]]]:
+        """
+        Submit independent requests through the Message Batches API (50% token cost)
+        
+        Args:
+            requests: [{"custom_id": ..., "params": build_params(...)}, ...]
+            poll_interval: Seconds between status checks
+        
+        Returns:
+            custom_id → (response, searches), or None for requests that did not
+            succeed or paused mid-turn (caller re-runs those online)
+        """
+        batch = self.client.messages.batches.create(requests=requests)
+        while batch.processing_status != "ended":
+            time.sleep(poll_interval)
+            batch = self.client.messages.batches.retrieve(batch.id)
+        
+        results = {}
+        for entry in self.client.messages.batches.results(batch.id):
+            message = entry.result.message if entry.result.type == "succeeded" else None
+            if message is None or message.stop_reason == "pause_turn":
+                results[entry.custom_id] = None
+            else:
+                results[entry.custom_id] = self._parse_message(message)
+        return results
+    
     def get_model_name(self) -> str:
         return f"Claude ({self.model})"
 
@@ -165,15 +761,21 @@ class ClaudeClient(BaseAIClient):
 class GPTClient(BaseAIClient):
     """GPT AI client (OpenAI)"""
     
-    def __init__(self, api_key: str, model: str = "gpt-4"):
+    def __init__(self, api_key: str, model: str = "gpt-4",
+                 call_timeout: Optional[float] = None):
         super().__init__()
         if not OPENAI_AVAILABLE:
             raise ImportError("OpenAI library not available")
-        self.client = openai.OpenAI(api_key=api_key)
+        # 요청 타임아웃을 call_timeout에 맞춤 (SDK 기본값 600초면 멈춘 호출이 호출 슬롯을 계속 차지)
+        timeout = {"timeout": call_timeout} if call_timeout is not None else {}
+        self.client = _shared_sdk_client(
+            ("openai", api_key, call_timeout), lambda: openai.OpenAI(api_key=api_key, **timeout)
+        )
         self.model = model
     
     def call(self, system_prompt: str, user_message: str, 
-             use_tools: bool = False) -> Tuple[str, List[Dict]]:
+             use_tools: bool = False,
+             max_tokens: int = DEFAULT_MAX_TOKENS) -> Tuple[str, List[Dict]]:
         try:
             messages = [
                 {"role": "system", "content": system_prompt},
@@ -185,23 +787,7 @@ class GPTClient(BaseAIClient):
             # OpenAI tool calling으로 웹 검색 구현
             tools = []
             if use_tools:
-                tools = [{
-                    "type": "function",
-                    "function": {
-                        "name": "web_search",
-                        "description": "최신 의학 데이터베이스와 웹 정보를 통합 검색하여 차등 진단 근거를 확보합니다. Search latest medical databases and web information to secure differential diagnosis evidence. Includes drug interactions, disease symptoms, treatment guidelines, and recent medical research.",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "query": {
-                                    "type": "string",
-                                    "description": "검색 쿼리 (의학 정보) / Search query for medical information"
-                                }
-                            },
-                            "required": ["query"]
-                        }
-                    }
-                }]
+                tools = [WEB_SEARCH_FUNCTION_TOOL]
             
             # 반복 루프: tool_use가 끝날 때까지 루프
             # 의학 진단에서는 약물검색(부작용/상호작용) + 질환검색 등 복수 검색이 필요
@@ -210,7 +796,7 @@ class GPTClient(BaseAIClient):
                 params = {
                     "model": self.model,
                     "messages": messages,
-                    "max_tokens": 3000
+                    "max_tokens": max_tokens
                 }
                 if tools:
                     params["tools"] = tools
@@ -252,8 +838,7 @@ class GPTClient(BaseAIClient):
                 for idx, tool_call in enumerate(response.choices[0].message.tool_calls):
                     query = tool_call.function.arguments
                     try:
-                        import json as json_module
-                        parsed = json_module.loads(query)
+                        parsed = _json_loads(query)
                         actual_query = parsed.get("query", query)
                     except Exception:
                         actual_query = query
@@ -261,7 +846,7 @@ class GPTClient(BaseAIClient):
                     search_queries.append({"query": actual_query, "tool": "web_search"})
                     
                     # 실제 웹 검색 실행
-                    search_result = self._execute_web_search(actual_query)
+                    search_result = self._web_search(actual_query)
                     
                     # FIX V3: tool_call_id는 매핑에서 가져오기 (객체 직접 참조 방지)
                     messages.append({
@@ -276,7 +861,7 @@ class GPTClient(BaseAIClient):
                 return "[Max tool iterations reached - pending tool responses]", search_queries
             
             final = self.client.chat.completions.create(
-                model=self.model, messages=messages, max_tokens=3000
+                model=self.model, messages=messages, max_tokens=max_tokens
             )
             return final.choices[0].message.content or "", search_queries
             
@@ -299,17 +884,17 @@ class GPTClient(BaseAIClient):
                 {
                     "name": "Bing",
                     "url": f"https://www.bing.com/search?q={quote(query)}",
-                    "snippet_pattern": r'<div class="[^"]*b_caption[^"]*">([^<]+)</div>'
+                    "snippet_pattern": _BING_SNIPPET_RE
                 },
                 {
                     "name": "DuckDuckGo Lite", 
                     "url": f"https://lite.duckduckgo.com/lite/?q={quote(query)}",
-                    "snippet_pattern": r'<td[^>]*>(.*?)</td>'
+                    "snippet_pattern": _DDG_SNIPPET_RE
                 },
                 {
                     "name": "Yahoo",
                     "url": f"https://search.yahoo.com/search?p={quote(query)}",
-                    "snippet_pattern": r'<p class="[^"]*s-desc[^"]*">([^<]+)</p>'
+                    "snippet_pattern": _YAHOO_SNIPPET_RE
                 }
             ]
             
@@ -322,21 +907,20 @@ class GPTClient(BaseAIClient):
                     resp = requests.get(engine["url"], headers=headers, timeout=10)
                     
                     if resp.status_code == 200:
-                        import re
                         text = resp.text
                         
                         # Script와 style 태그 제거
-                        text = re.sub(r'<script[^>]*>.*?</script>', ' ', text, flags=re.DOTALL | re.IGNORECASE)
-                        text = re.sub(r'<style[^>]*>.*?</style>', ' ', text, flags=re.DOTALL | re.IGNORECASE)
+                        text = _SCRIPT_TAG_RE.sub(' ', text)
+                        text = _STYLE_TAG_RE.sub(' ', text)
                         
                         # 검색 결과 스니펫 추출
-                        snippets = re.findall(engine["snippet_pattern"], text, re.DOTALL)
+                        snippets = engine["snippet_pattern"].findall(text)
                         
                         if snippets:
                             for i, snippet in enumerate(snippets[:5], 1):
                                 # HTML 태그 제거
-                                clean_snippet = re.sub(r'<[^>]+>', ' ', snippet)
-                                clean_snippet = re.sub(r'\s+', ' ', clean_snippet).strip()
+                                clean_snippet = _HTML_TAG_RE.sub(' ', snippet)
+                                clean_snippet = _WHITESPACE_RE.sub(' ', clean_snippet).strip()
                                 if clean_snippet and len(clean_snippet) > 20:
                                     results.append(f"Result {i}: {clean_snippet}")
                             
@@ -364,12 +948,15 @@ class GPTClient(BaseAIClient):
 class GeminiClient(BaseAIClient):
     """Gemini AI client (Google)"""
     
-    def __init__(self, api_key: str, model: str = "gemini-2.0-flash"):
+    def __init__(self, api_key: str, model: str = "gemini-2.0-flash",
+                 call_timeout: Optional[float] = None):
         super().__init__()
         if not GEMINI_AVAILABLE:
             raise ImportError("Google Gemini library not available")
         genai.configure(api_key=api_key)
         self.model_name = model
+        # SDK 기본값은 타임아웃 없음 → 요청마다 call_timeout 적용
+        self.request_options = {"timeout": call_timeout} if call_timeout is not None else {}
         
         # FIX: 도구를 __init__ 시점에 바인딩 (권장 방식)
         # 이렇게 하면 런타임 도구 전달이 무시되는 문제 방지
@@ -384,7 +971,8 @@ class GeminiClient(BaseAIClient):
             self.tools_enabled = False
     
     def call(self, system_prompt: str, user_message: str, 
-             use_tools: bool = False) -> Tuple[str, List[Dict]]:
+             use_tools: bool = False,
+             max_tokens: int = DEFAULT_MAX_TOKENS) -> Tuple[str, List[Dict]]:
         self._rate_limit_check()  # Rate limiting 적용
         
         for attempt in range(self.max_retries):
@@ -396,7 +984,9 @@ class GeminiClient(BaseAIClient):
                 # 도구가 이미 __init__에서 바인딩되었으므로
                 # use_tools 파라미터는 검색 쿼리 추출 여부만 제어
                 if use_tools and self.tools_enabled:
-                    response = self.model.generate_content(full_prompt)
+                    response = self.model.generate_content(
+                        full_prompt, generation_config={"max_output_tokens": max_tokens},
+                        request_options=self.request_options)
                     
                     # Function call 처리 (Gemini 1.5+)
                     if hasattr(response, 'candidates') and response.candidates:
@@ -424,13 +1014,15 @@ class GeminiClient(BaseAIClient):
                                     search_queries.append({"query": q, "tool": "google_search"})
                 else:
                     # 도구 비활성화
-                    response = self.model.generate_content(full_prompt)
+                    response = self.model.generate_content(
+                        full_prompt, generation_config={"max_output_tokens": max_tokens},
+                        request_options=self.request_options)
                 
                 return response.text, search_queries
                 
             except Exception as e:
                 if attempt < self.max_retries - 1:
-                    print(f"⚠️ Gemini error, retrying (attempt {attempt + 1}/{self.max_retries})")
+                    self.log(f"⚠️ Gemini error, retrying (attempt {attempt + 1}/{self.max_retries})")
                     time.sleep(2 ** attempt)
                 else:
                     return f"[Gemini Error: {str(e)}]", []
@@ -444,134 +1036,124 @@ class GeminiClient(BaseAIClient):
 class GrokClient(BaseAIClient):
     """Grok AI client (xAI) - OpenAI compatible API"""
     
-    def __init__(self, api_key: str, model: str = "grok-4"):
+    def __init__(self, api_key: str, model: str = "grok-4",
+                 call_timeout: Optional[float] = None):
         super().__init__()  # Rate limiting 초기화
         if not GROK_AVAILABLE:
             raise ImportError("OpenAI library not available (needed for Grok)")
-        self.client = openai.OpenAI(
-            api_key=api_key,
-            base_url="https://api.x.ai/v1"
+        timeout = {"timeout": call_timeout} if call_timeout is not None else {}
+        self.client = _shared_sdk_client(
+            ("grok", api_key, call_timeout),
+            lambda: openai.OpenAI(
+                api_key=api_key,
+                base_url="https://api.x.ai/v1",
+                **timeout
+            )
         )
         self.model = model
     
     def call(self, system_prompt: str, user_message: str, 
-             use_tools: bool = False) -> Tuple[str, List[Dict]]:
+             use_tools: bool = False,
+             max_tokens: int = DEFAULT_MAX_TOKENS) -> Tuple[str, List[Dict]]:
         self._rate_limit_check()  # Rate limiting 적용
         
         for attempt in range(self.max_retries):
             try:
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ]
+                messages = [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_message}
+                ]
             
-            search_queries = []
+                search_queries = []
             
-            # Grok도 OpenAI 호환 tool calling 사용
-            tools = []
-            if use_tools:
-                tools = [{
-                    "type": "function",
-                    "function": {
-                        "name": "web_search",
-                        "description": "최신 의학 데이터베이스와 웹 정보를 통합 검색하여 차등 진단 근거를 확보합니다. Search latest medical databases and web information to secure differential diagnosis evidence. Includes drug interactions, disease symptoms, treatment guidelines, and recent medical research.",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "query": {
-                                    "type": "string",
-                                    "description": "검색 쿼리 (의학 정보) / Search query for medical information"
-                                }
-                            },
-                            "required": ["query"]
-                        }
-                    }
-                }]
+                # Grok도 OpenAI 호환 tool calling 사용
+                tools = []
+                if use_tools:
+                    tools = [WEB_SEARCH_FUNCTION_TOOL]
             
-            # 반복 루프: tool_use가 끝날 때까지
-            # 의학 진단에서는 약물검색(부작용/상호작용) + 질환검색 등 복수 검색이 필요
-            max_tool_iterations = 10
-            for iteration in range(max_tool_iterations):
-                params = {
-                    "model": self.model,
-                    "messages": messages,
-                    "max_tokens": 3000
-                }
-                if tools:
-                    params["tools"] = tools
-                    params["tool_choice"] = "auto"
+                # 반복 루프: tool_use가 끝날 때까지
+                # 의학 진단에서는 약물검색(부작용/상호작용) + 질환검색 등 복수 검색이 필요
+                max_tool_iterations = 10
+                for iteration in range(max_tool_iterations):
+                    params = {
+                        "model": self.model,
+                        "messages": messages,
+                        "max_tokens": max_tokens
+                    }
+                    if tools:
+                        params["tools"] = tools
+                        params["tool_choice"] = "auto"
                 
-                response = self.client.chat.completions.create(**params)
+                    response = self.client.chat.completions.create(**params)
                 
-                if not response.choices[0].message.tool_calls:
-                    return response.choices[0].message.content or "", search_queries
+                    if not response.choices[0].message.tool_calls:
+                        return response.choices[0].message.content or "", search_queries
                 
-                # FIX: message 객체를 dict로 변환
-                # FIX #2: tool_calls 객체를 JSON 직렬화 가능한 dict로 변환
-                # FIX V3: tool_call.id도 나중에 사용하므로 저장 필요
-                tool_calls_dict = []
-                tool_call_id_map = {}
+                    # FIX: message 객체를 dict로 변환
+                    # FIX #2: tool_calls 객체를 JSON 직렬화 가능한 dict로 변환
+                    # FIX V3: tool_call.id도 나중에 사용하므로 저장 필요
+                    tool_calls_dict = []
+                    tool_call_id_map = {}
                 
-                if response.choices[0].message.tool_calls:
-                    for idx, tc in enumerate(response.choices[0].message.tool_calls):
-                        tc_dict = {
-                            "id": tc.id,
-                            "type": tc.type,
-                            "function": {
-                                "name": tc.function.name,
-                                "arguments": tc.function.arguments
+                    if response.choices[0].message.tool_calls:
+                        for idx, tc in enumerate(response.choices[0].message.tool_calls):
+                            tc_dict = {
+                                "id": tc.id,
+                                "type": tc.type,
+                                "function": {
+                                    "name": tc.function.name,
+                                    "arguments": tc.function.arguments
+                                }
                             }
-                        }
-                        tool_calls_dict.append(tc_dict)
-                        tool_call_id_map[idx] = tc.id
+                            tool_calls_dict.append(tc_dict)
+                            tool_call_id_map[idx] = tc.id
                 
-                assistant_msg = {
-                    "role": "assistant",
-                    "content": response.choices[0].message.content,
-                    "tool_calls": tool_calls_dict
-                }
-                messages.append(assistant_msg)
+                    assistant_msg = {
+                        "role": "assistant",
+                        "content": response.choices[0].message.content,
+                        "tool_calls": tool_calls_dict
+                    }
+                    messages.append(assistant_msg)
                 
-                for idx, tool_call in enumerate(response.choices[0].message.tool_calls):
-                    query = tool_call.function.arguments
-                    try:
-                        import json as json_module
-                        parsed = json_module.loads(query)
-                        actual_query = parsed.get("query", query)
-                    except Exception:
-                        actual_query = query
+                    for idx, tool_call in enumerate(response.choices[0].message.tool_calls):
+                        query = tool_call.function.arguments
+                        try:
+                            parsed = _json_loads(query)
+                            actual_query = parsed.get("query", query)
+                        except Exception:
+                            actual_query = query
                     
-                    search_queries.append({"query": actual_query, "tool": "web_search"})
+                        search_queries.append({"query": actual_query, "tool": "web_search"})
                     
-                    search_result = self._execute_web_search(actual_query)
+                        search_result = self._web_search(actual_query)
                     
-                    # FIX V3: tool_call_id는 매핑에서 가져오기
-                    messages.append({
-                        "role": "tool",
-                        "tool_call_id": tool_call_id_map[idx],
-                        "content": search_result
-                    })
+                        # FIX V3: tool_call_id는 매핑에서 가져오기
+                        messages.append({
+                            "role": "tool",
+                            "tool_call_id": tool_call_id_map[idx],
+                            "content": search_result
+                        })
             
-            # FIX: 루프 종료 후 최종 응답 - 무한 루프 방지
-            if messages[-1]["role"] == "tool":
-                return "[Max tool iterations reached - pending tool responses]", search_queries
+                # FIX: 루프 종료 후 최종 응답 - 무한 루프 방지
+                if messages[-1]["role"] == "tool":
+                    return "[Max tool iterations reached - pending tool responses]", search_queries
             
-            final = self.client.chat.completions.create(
-                model=self.model, messages=messages, max_tokens=3000
-            )
-            return final.choices[0].message.content or "", search_queries
+                final = self.client.chat.completions.create(
+                    model=self.model, messages=messages, max_tokens=max_tokens
+                )
+                return final.choices[0].message.content or "", search_queries
                 
             except openai.RateLimitError as e:
                 if attempt < self.max_retries - 1:
                     wait_time = 2 ** attempt
-                    print(f"⚠️ Grok Rate limit, retry in {wait_time}s (attempt {attempt + 1}/{self.max_retries})")
+                    self.log(f"⚠️ Grok Rate limit, retry in {wait_time}s (attempt {attempt + 1}/{self.max_retries})")
                     time.sleep(wait_time)
                 else:
                     return f"[Grok Error: Rate limit exceeded]", []
                     
             except openai.APIError as e:
                 if attempt < self.max_retries - 1:
-                    print(f"⚠️ Grok API error, retrying (attempt {attempt + 1}/{self.max_retries})")
+                    self.log(f"⚠️ Grok API error, retrying (attempt {attempt + 1}/{self.max_retries})")
                     time.sleep(1)
                 else:
                     return f"[Grok Error: {str(e)}]", []
@@ -597,17 +1179,17 @@ class GrokClient(BaseAIClient):
                 {
                     "name": "Bing",
                     "url": f"https://www.bing.com/search?q={quote(query)}",
-                    "snippet_pattern": r'<div class="[^"]*b_caption[^"]*">([^<]+)</div>'
+                    "snippet_pattern": _BING_SNIPPET_RE
                 },
                 {
                     "name": "DuckDuckGo Lite", 
                     "url": f"https://lite.duckduckgo.com/lite/?q={quote(query)}",
-                    "snippet_pattern": r'<td[^>]*>(.*?)</td>'
+                    "snippet_pattern": _DDG_SNIPPET_RE
                 },
                 {
                     "name": "Yahoo",
                     "url": f"https://search.yahoo.com/search?p={quote(query)}",
-                    "snippet_pattern": r'<p class="[^"]*s-desc[^"]*">([^<]+)</p>'
+                    "snippet_pattern": _YAHOO_SNIPPET_RE
                 }
             ]
             
@@ -620,21 +1202,20 @@ class GrokClient(BaseAIClient):
                     resp = requests.get(engine["url"], headers=headers, timeout=10)
                     
                     if resp.status_code == 200:
-                        import re
                         text = resp.text
                         
                         # Script와 style 태그 제거
-                        text = re.sub(r'<script[^>]*>.*?</script>', ' ', text, flags=re.DOTALL | re.IGNORECASE)
-                        text = re.sub(r'<style[^>]*>.*?</style>', ' ', text, flags=re.DOTALL | re.IGNORECASE)
+                        text = _SCRIPT_TAG_RE.sub(' ', text)
+                        text = _STYLE_TAG_RE.sub(' ', text)
                         
                         # 검색 결과 스니펫 추출
-                        snippets = re.findall(engine["snippet_pattern"], text, re.DOTALL)
+                        snippets = engine["snippet_pattern"].findall(text)
                         
                         if snippets:
                             for i, snippet in enumerate(snippets[:5], 1):
                                 # HTML 태그 제거
-                                clean_snippet = re.sub(r'<[^>]+>', ' ', snippet)
-                                clean_snippet = re.sub(r'\s+', ' ', clean_snippet).strip()
+                                clean_snippet = _HTML_TAG_RE.sub(' ', snippet)
+                                clean_snippet = _WHITESPACE_RE.sub(' ', clean_snippet).strip()
                                 if clean_snippet and len(clean_snippet) > 20:
                                     results.append(f"Result {i}: {clean_snippet}")
                             
@@ -662,12 +1243,15 @@ class GrokClient(BaseAIClient):
 class GeminiClient(BaseAIClient):
     """Gemini AI client (Google)"""
     
-    def __init__(self, api_key: str, model: str = "gemini-2.0-flash"):
+    def __init__(self, api_key: str, model: str = "gemini-2.0-flash",
+                 call_timeout: Optional[float] = None):
         super().__init__()
         if not GEMINI_AVAILABLE:
             raise ImportError("Google Gemini library not available")
         genai.configure(api_key=api_key)
         self.model_name = model
+        # SDK 기본값은 타임아웃 없음 → 요청마다 call_timeout 적용
+        self.request_options = {"timeout": call_timeout} if call_timeout is not None else {}
         
         # FIX: 도구를 __init__ 시점에 바인딩 (권장 방식)
         # 이렇게 하면 런타임 도구 전달이 무시되는 문제 방지
@@ -682,7 +1266,8 @@ class GeminiClient(BaseAIClient):
             self.tools_enabled = False
     
     def call(self, system_prompt: str, user_message: str, 
-             use_tools: bool = False) -> Tuple[str, List[Dict]]:
+             use_tools: bool = False,
+             max_tokens: int = DEFAULT_MAX_TOKENS) -> Tuple[str, List[Dict]]:
         self._rate_limit_check()  # Rate limiting 적용
         
         for attempt in range(self.max_retries):
@@ -694,7 +1279,9 @@ class GeminiClient(BaseAIClient):
                 # 도구가 이미 __init__에서 바인딩되었으므로
                 # use_tools 파라미터는 검색 쿼리 추출 여부만 제어
                 if use_tools and self.tools_enabled:
-                    response = self.model.generate_content(full_prompt)
+                    response = self.model.generate_content(
+                        full_prompt, generation_config={"max_output_tokens": max_tokens},
+                        request_options=self.request_options)
                     
                     # Function call 처리 (Gemini 1.5+)
                     if hasattr(response, 'candidates') and response.candidates:
@@ -722,13 +1309,15 @@ class GeminiClient(BaseAIClient):
                                     search_queries.append({"query": q, "tool": "google_search"})
                 else:
                     # 도구 비활성화
-                    response = self.model.generate_content(full_prompt)
+                    response = self.model.generate_content(
+                        full_prompt, generation_config={"max_output_tokens": max_tokens},
+                        request_options=self.request_options)
                 
                 return response.text, search_queries
                 
             except Exception as e:
                 if attempt < self.max_retries - 1:
-                    print(f"⚠️ Gemini error, retrying (attempt {attempt + 1}/{self.max_retries})")
+                    self.log(f"⚠️ Gemini error, retrying (attempt {attempt + 1}/{self.max_retries})")
                     time.sleep(2 ** attempt)
                 else:
                     return f"[Gemini Error: {str(e)}]", []
@@ -739,6 +1328,63 @@ class GeminiClient(BaseAIClient):
         return f"Grok ({self.model})"
 
 
+# 언어별 UI 문자열 / 프롬프트 지시문 (호출마다 다시 만들지 않도록 모듈 상수로 유지)
+LANGUAGE_NAMES = {
+    'en': 'English',
+    'ko': '한국어 (Korean)',
+    'es': 'Español (Spanish)',
+    'ja': '日本語 (Japanese)',
+    'zh': '中文 (Chinese)',
+    'fr': 'Français (French)',
+    'de': 'Deutsch (German)'
+}
+
+LANGUAGE_INSTRUCTIONS = {
+    'en': "Respond in English.",
+    'ko': "Respond in Korean (한국어).",
+    'es': "Responde en español.",
+    'ja': "日本語で回答してください。",
+    'zh': "请用中文回答。",
+    'fr': "Répondez en français.",
+    'de': "Antworten Sie auf Deutsch."
+}
+
+UI_TRANSLATIONS = {
+    'creating_doctors': {
+        'en': 'Created {} independent AI doctors:',
+        'ko': '{}명의 독립적인 AI 의사 생성 완료:'
+    },
+    'dual_referees': {
+        'en': 'Created dual referee system:',
+        'ko': '이중 심판 시스템 생성 완료:'
+    },
+    'referee_reset_schedule': {
+        'en': '→ Referee A resets at rounds: 5, 10, 15, 20, ...',
+        'ko': '→ 심판 A 초기화: 5, 10, 15, 20, ... 라운드'
+    },
+    'circular_groups': {
+        'en': 'Circular overlap groups:',
+        'ko': '순환 중첩 그룹:'
+    },
+    'active_referee': {
+        'en': 'Active referee:',
+        'ko': '활성 심판:'
+    },
+    'resetting_referee': {
+        'en': 'Resetting {} (contamination prevention)',
+        'ko': '{} 초기화 (오염 제거)'
+    },
+    'consensus_reached': {
+        'en': 'Consensus reached! Diagnosis complete.',
+        'ko': '합의 도달! 진단 완료.'
+    },
+    'max_rounds': {
+        'en': 'Max rounds reached. Outputting current opinions.',
+        'ko': '최대 라운드 도달. 현재까지의 의견을 출력합니다.'
+    }
+}
+
+
 @dataclass
 class Doctor:
     """Independent doctor agent with specific AI model"""
@@ -749,9 +1395,16 @@ class Doctor:
     ai_provider: AIProvider
     ai_client: BaseAIClient
     language: str = "en"  # Add language parameter
+    # 페르소나 프롬프트는 인스턴스당 한 번만 생성 (매 호출 동일 문자열 → 프롬프트 캐시 안정)
+    _persona_prompt: Optional[str] = field(default=None, init=False, repr=False)
     
     def get_persona_prompt(self) -> str:
         """Generate unique persona for this doctor"""
+        if self._persona_prompt is None:
+            self._persona_prompt = self._build_persona_prompt()
+        return self._persona_prompt
+    
+    def _build_persona_prompt(self) -> str:
         traits_str = ", ".join(self.personality_traits)
         
         if self.language == 'ko':
@@ -783,17 +1436,19 @@ Especially search for rare diseases or complex symptoms.
 Respond in English.
 """
     
-    def think(self, context: str, question: str, use_web_search: bool = True) -> Tuple[str, List[Dict]]:
+    def think(self, context: str, question: str, use_web_search: bool = True,
+              max_tokens: int = DOCTOR_MAX_TOKENS) -> Tuple[str, List[Dict]]:
         """
         Independent thinking and opinion formation
         """
         system_prompt = self.get_persona_prompt()
-        full_message = f"{context}\n\n{question}"
         
-        response, searches = self.ai_client.call(
-            system_prompt, 
-            full_message, 
-            use_tools=use_web_search
+        response, searches = self.ai_client.call_with_context(
+            system_prompt,
+            context,
+            question,
+            use_tools=use_web_search,
+            max_tokens=max_tokens
         )
         
         return response, searches
@@ -811,8 +1466,14 @@ class Referee:
     initialization_round: int  # Round when this referee is initialized/reset
     language: str = "en"
     memory: List[Dict] = field(default_factory=list)  # FIX: 심판 개인 메모리 (오염 방지)
+    _persona_prompt: Optional[str] = field(default=None, init=False, repr=False)
     
     def get_persona_prompt(self) -> str:
+        if self._persona_prompt is None:
+            self._persona_prompt = self._build_persona_prompt()
+        return self._persona_prompt
+    
+    def _build_persona_prompt(self) -> str:
         if self.language == 'ko':
             return f"""당신은 {self.name}, 공정한 의료 진단 심판입니다.
 경력: 30년 진단의학 경력
@@ -862,13 +1523,16 @@ You are neutral and objective. Your goal is accurate diagnosis, not winning deba
 Respond in English.
 """
     
-    def evaluate(self, context: str, question: str) -> Tuple[str, List[Dict]]:
+    def evaluate(self, context: str, question: str,
+                 max_tokens: int = REFEREE_MAX_TOKENS) -> Tuple[str, List[Dict]]:
         """Evaluate debate and provide feedback"""
         system_prompt = self.get_persona_prompt()
-        response, searches = self.ai_client.call(
+        response, searches = self.ai_client.call_with_context(
             system_prompt,
-            f"{context}\n\n{question}",
-            use_tools=True
+            context,
+            question,
+            use_tools=True,
+            max_tokens=max_tokens
         )
         return response, searches
     
@@ -899,18 +1563,66 @@ class MultiAIDiagnosisSystem:
     - Multi-language support (Korean, English, etc.)
     """
     
-    def __init__(self, api_keys: Dict[str, str], language: str = "en"):
+    def __init__(self, api_keys: Dict[str, str], language: str = "en",
+                 cache_response: bool = True, use_batch: bool = False,
+                 batch_poll_interval: float = 10.0, history_window: int = 20,
+                 transcript_path: Optional[str] = None,
+                 max_concurrency: int = 4, call_timeout: float = 120.0,
+                 prompt_cache_ttl: Optional[str] = None,
+                 stall_timeout: float = 60.0, stall_retries: int = 1,
+                 progress_every: int = 0, slot_timeout: Optional[float] = None):
         """
         Initialize system with API keys for different providers
         
         Args:
             api_keys: Dictionary with keys 'claude', 'openai', 'gemini', 'grok'
             language: Language code ('en', 'ko', 'es', 'ja', 'zh', etc.)
+            cache_response: Cache Claude responses and final diagnoses locally
+                (SQLite) for replays; MDS_CACHE=off disables both
+            use_batch: Send Claude doctors' opinions through the Message Batches API
+                (half the token cost, but each stage waits for batch completion)
+            batch_poll_interval: Seconds between batch status checks
+            history_window: Number of most recent round records kept in debate_history
+            transcript_path: Optional JSONL file that debate output is appended to
+            max_concurrency: Maximum doctor calls in flight at once (keeps bursts
+                under provider rate limits; lower it for web-search-heavy runs)
+            call_timeout: Seconds to wait for one doctor call before recording a timeout
+                (also the HTTP timeout of GPT/Grok/Gemini requests)
+            prompt_cache_ttl: Claude prompt cache lifetime ("5m" default, "1h" for
+                slow rounds — referees only speak every other round)
+            stall_timeout: Seconds without any stream data before a Claude call is
+                dropped and retried
+            stall_retries: How many times a stalled Claude stream is retried
+            progress_every: Log a streaming progress line every N chunks per Claude
+                call (0 = off)
+            slot_timeout: Seconds a doctor or referee call waits for a free call slot
+                before recording a timeout (default: call_timeout)
         """
         self.api_keys = api_keys
+        if os.environ.get("MDS_CACHE", "").lower() == "off":
+            cache_response = False
+        self.response_cache = ResponseCache() if cache_response else None
+        self.answer_cache = AnswerCache() if cache_response else None
+        self.use_batch = use_batch
+        self.batch_poll_interval = batch_poll_interval
+        self.max_concurrency = max_concurrency
+        # 의사 호출 슬롯: 스레드 세마포어로 SDK 호출이 실제로 실행 중인 동안만 점유
+        self._call_slots = threading.BoundedSemaphore(max_concurrency)
+        self.call_timeout = call_timeout
+        # 슬롯 대기도 제한: 멈춘 호출들이 슬롯을 모두 차지해도 이후 라운드/심판이 무한히 기다리지 않음
+        self.slot_timeout = call_timeout if slot_timeout is None else slot_timeout
+        self.prompt_cache_ttl = prompt_cache_ttl
+        self.stall_timeout = stall_timeout
+        self.stall_retries = stall_retries
+        self.progress_every = progress_every
         self.doctors: List[Doctor] = []
         self.referees: List[Referee] = []
-        self.debate_history: List[Dict] = []
+        # 최근 라운드 기록만 유지 (긴 토론에서도 메모리 사용량 고정)
+        self.debate_history: Deque[Dict] = deque(maxlen=history_window)
+        # 토론 출력은 백그라운드 스레드가 기록 (콘솔/파일 I/O가 토론 루프를 막지 않도록)
+        self._log = TranscriptWriter(transcript_path)
+        # 현재 토론의 검색 공유 브로커 (리셋으로 새로 만든 클라이언트에도 연결)
+        self.search_broker: Optional[SearchBroker] = None
         self.current_round = 0
         self.language = language
         
@@ -931,82 +1643,51 @@ class MultiAIDiagnosisSystem:
         print(f"✅ Available AI providers: {[p.value for p in self.available_providers]}")
         print(f"🌐 Language: {self._get_language_name(language)}")
     
+    def close(self) -> None:
+        """Flush and stop the transcript writer (the system is not usable afterwards)"""
+        self._log.close()
+    
+    def __enter__(self) -> "MultiAIDiagnosisSystem":
+        return self
+    
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+    
     def _get_language_name(self, code: str) -> str:
         """Get language name from code"""
-        languages = {
-            'en': 'English',
-            'ko': '한국어 (Korean)',
-            'es': 'Español (Spanish)',
-            'ja': '日本語 (Japanese)',
-            'zh': '中文 (Chinese)',
-            'fr': 'Français (French)',
-            'de': 'Deutsch (German)'
-        }
-        return languages.get(code, code)
+        return LANGUAGE_NAMES.get(code, code)
     
     def _get_language_instruction(self) -> str:
         """Get language instruction for AI prompts"""
-        instructions = {
-            'en': "Respond in English.",
-            'ko': "Respond in Korean (한국어).",
-            'es': "Responde en español.",
-            'ja': "日本語で回答してください。",
-            'zh': "请用中文回答。",
-            'fr': "Répondez en français.",
-            'de': "Antworten Sie auf Deutsch."
-        }
-        return instructions.get(self.language, "Respond in English.")
+        return LANGUAGE_INSTRUCTIONS.get(self.language, "Respond in English.")
     
     def _translate(self, key: str) -> str:
         """Get translated text for UI elements"""
-        translations = {
-            'creating_doctors': {
-                'en': 'Created {} independent AI doctors:',
-                'ko': '{}명의 독립적인 AI 의사 생성 완료:'
-            },
-            'dual_referees': {
-                'en': 'Created dual referee system:',
-                'ko': '이중 심판 시스템 생성 완료:'
-            },
-            'referee_reset_schedule': {
-                'en': '→ Referee A resets at rounds: 5, 10, 15, 20, ...',
-                'ko': '→ 심판 A 초기화: 5, 10, 15, 20, ... 라운드'
-            },
-            'circular_groups': {
-                'en': 'Circular overlap groups:',
-                'ko': '순환 중첩 그룹:'
-            },
-            'active_referee': {
-                'en': 'Active referee:',
-                'ko': '활성 심판:'
-            },
-            'resetting_referee': {
-                'en': 'Resetting {} (contamination prevention)',
-                'ko': '{} 초기화 (오염 제거)'
-            },
-            'consensus_reached': {
-                'en': 'Consensus reached! Diagnosis complete.',
-                'ko': '합의 도달! 진단 완료.'
-            },
-            'max_rounds': {
-                'en': 'Max rounds reached. Outputting current opinions.',
-                'ko': '최대 라운드 도달. 현재까지의 의견을 출력합니다.'
-            }
-        }
-        
-        text_dict = translations.get(key, {})
+        text_dict = UI_TRANSLATIONS.get(key, {})
         return text_dict.get(self.language, text_dict.get('en', key))
     
     def _create_ai_client(self, provider: AIProvider) -> BaseAIClient:
         """Create AI client for the specified provider"""
+        client = self._new_ai_client(provider)
+        # 클라이언트 메시지도 토론 출력과 같은 큐로 보내 순서가 섞이지 않도록 함
+        client.log = self._log.write
+        client.search_broker = self.search_broker
+        return client
+    
+    def _new_ai_client(self, provider: AIProvider) -> BaseAIClient:
         if provider == AIProvider.CLAUDE:
-            return ClaudeClient(self.api_keys['claude'])
+            return ClaudeClient(self.api_keys['claude'], cache_ttl=self.prompt_cache_ttl,
+                                response_cache=self.response_cache,
+                                stall_timeout=self.stall_timeout,
+                                stall_retries=self.stall_retries,
+                                progress_every=self.progress_every,
+                                call_timeout=self.call_timeout)
         elif provider == AIProvider.GPT:
-            return GPTClient(self.api_keys['openai'])
+            return GPTClient(self.api_keys['openai'], call_timeout=self.call_timeout)
         elif provider == AIProvider.GEMINI:
-            return GeminiClient(self.api_keys['gemini'])
+            return GeminiClient(self.api_keys['gemini'], call_timeout=self.call_timeout)
         elif provider == AIProvider.GROK:
-            return GrokClient(self.api_keys['grok'])
+            return GrokClient(self.api_keys['grok'], call_timeout=self.call_timeout)
         else:
             raise ValueError(f"Unknown provider: {provider}")
     
@@ -1143,7 +1824,7 @@ class MultiAIDiagnosisSystem:
     
     def reset_referee(self, referee: Referee) -> None:
         """Reset referee by creating new AI client instance"""
-        print(f"  🔄 Resetting {referee.name} (contamination prevention)")
+        self._log.write(f"  🔄 Resetting {referee.name} (contamination prevention)")
         referee.ai_client = self._create_ai_client(referee.ai_provider)
         # FIX: 심판의 개인 메모리도 초기화 (완전한 오염 제거)
         referee.memory = []
@@ -1273,14 +1954,27 @@ class MultiAIDiagnosisSystem:
         """
         Run diagnosis with multi-AI debate
         """
-        print("=" * 80)
-        print(f"환자: {patient.age}세 {patient.gender}")
-        print(f"주 증상: {', '.join(patient.chief_complaints)}")
-        print(f"병력: {patient.history}")
+        # 큐에 남은 토론 출력이 있으면 먼저 내보낸 뒤 직접 출력
+        self._log.flush()
+        header = [
+            "=" * 80,
+            f"환자: {patient.age}세 {patient.gender}",
+            f"주 증상: {', '.join(patient.chief_complaints)}",
+            f"병력: {patient.history}",
+        ]
         if patient.actual_diseases:
-            print(f"실제 질환 (테스트용): {', '.join(patient.actual_diseases)}")
-        print("=" * 80)
-        print()
+            header.append(f"실제 질환 (테스트용): {', '.join(patient.actual_diseases)}")
+        header += ["=" * 80, ""]
+        print("\n".join(header))
+        
+        # 동일 환자/설정으로 이미 완료된 진단이 있으면 토론 없이 반환
+        answer_key = None
+        if self.answer_cache is not None:
+            answer_key = self._answer_key(patient, max_rounds)
+            cached = self.answer_cache.get(answer_key)
+            if cached is not None:
+                print("♻️ Cached diagnosis found (set MDS_CACHE=off to run a new debate)\n")
+                return {"patient": patient, **cached}
         
         # 1. Select specialties
         specialties = self._select_specialties(patient)
@@ -1298,8 +1992,373 @@ class MultiAIDiagnosisSystem:
         # 5. Conduct debate
         result = self._conduct_debate(patient, groups, max_rounds)
         
+        # 어느 라운드에서든 호출이 실패한 결과(오류 응답, 누락된 그룹, 심판 오류)는 재사용하지 않음
+        if answer_key is not None and result["failed_calls"] == 0:
+            self.answer_cache.put(answer_key, {k: v for k, v in result.items() if k != "patient"})
+        
         return result
     
+    def diagnose_batch(self, patients: List[Patient], max_rounds: int = 5,
+                       batch_threshold: int = 8, max_workers: int = 8) -> List[Dict]:
+        """
+        Diagnose several patients (offline / evaluation runs)
+        
+        Below batch_threshold patients, cases run one after another as usual.
+        From batch_threshold up, debates run concurrently and every Claude
+        doctor call goes through the Message Batches API (half the token cost);
+        while one debate waits on its batch, the others keep working.
+        Rounds within each debate stay sequential, since round N+1 needs the
+        referee feedback from round N. All debates draw from this system's
+        max_concurrency call slots, so online calls (non-Claude doctors,
+        batch fallbacks, referees) stay within the same rate-limit bound as a
+        single debate. Console output of concurrent debates interleaves, so
+        pass transcript_path when the log matters.
+        
+        Returns results in the same order as patients.
+        """
+        if len(patients) < batch_threshold:
+            return [self.diagnose(patient, max_rounds) for patient in patients]
+        
+        def run(patient: Patient) -> Dict:
+            # 환자별 토론 상태(의사/심판/라운드 기록)는 분리하고 캐시/클라이언트 설정은 공유
+            # 얕은 복사이므로 _call_slots도 공유 → 전체 워커의 동시 호출 수가 max_concurrency로 제한됨
+            worker = copy.copy(self)
+            worker.use_batch = True
+            worker.debate_history = deque(maxlen=self.debate_history.maxlen)
+            return worker.diagnose(patient, max_rounds)
+        
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(patients)),
+                                thread_name_prefix="diagnosis") as pool:
+            return list(pool.map(run, patients))
+    
+    def _answer_key(self, patient: Patient, max_rounds: int) -> str:
+        """Answer cache key: everything that shapes the debate (actual_diseases is a test label only)"""
+        presentation = {
+            "age": patient.age,
+            "gender": patient.gender,
+            "chief_complaints": patient.chief_complaints,
+            "history": patient.history,
+            "current_medications": sorted(patient.current_medications),
+            "allergies": sorted(patient.allergies),
+        }
+        return ResponseCache.make_key(
+            "diagnosis", self.language, max_rounds,
+            [p.value for p in self.available_providers], presentation
+        )
+    
+    @staticmethod
+    def _first_opinion_question(doc2: Doctor, previous_feedback: str) -> str:
+        # Doctor 1 opinion — 이전 심판 피드백 포함
+        return f"""
+Analyze this patient's symptoms and provide possible diagnoses.
+If rare or complex, use web search for latest information.
+You will discuss with Dr. {doc2.name}, so provide clear evidence.
+{previous_feedback}"""
+    
+    @staticmethod
+    def _second_opinion_question(doc1: Doctor, opinion1: str, previous_feedback: str) -> str:
+        return f"""
+As an independent doctor, provide your own opinion.
+You may agree or disagree with Dr. {doc1.name}.
+Use web search for latest information.
+
+Dr. {doc1.name} provided this opinion:
+
+{opinion1}
+{previous_feedback}"""
+    
+    @staticmethod
+    def _group_result(idx: int, doc1: Doctor, doc2: Doctor,
+                      opinion1: str, searches1: List[Dict],
+                      opinion2: str, searches2: List[Dict]) -> Tuple[Dict, List[Dict], str]:
+        """
+        Package one group's opinions as (group opinion, searches, console output)
+        Output is buffered so concurrently running groups don't interleave on the terminal
+        """
+        lines = [f"--- Group {idx}: {doc1.name} ({doc1.ai_client.get_model_name()}) + "
+                 f"{doc2.name} ({doc2.ai_client.get_model_name()}) ---"]
+        for doc, opinion, searches, prefix in ((doc1, opinion1, searches1, "\n"),
+                                               (doc2, opinion2, searches2, "")):
+            lines.append(f"{prefix}[{doc.name} - {doc.ai_client.get_model_name()}]")
+            for s in searches:
+                lines.append(f"  🔍 Search: {s['query']}")
+            display = opinion[:500] + ("..." if len(opinion) > 500 else "")
+            lines.append(f"{display}\n")
+        
+        group_opinion = {
+            "group": idx,
+            "doctors": [doc1.name, doc2.name],
+            "models": [doc1.ai_client.get_model_name(), doc2.ai_client.get_model_name()],
+            "opinion1": opinion1,
+            "opinion2": opinion2
+        }
+        return group_opinion, searches1 + searches2, "\n".join(lines)
+    
+    def _think_limited(self, doc: Doctor, context: str, question: str,
+                       executor: ThreadPoolExecutor) -> Tuple[str, List[Dict]]:
+        """
+        One doctor call in a worker thread, holding one of the max_concurrency call slots
+        A call that exceeds call_timeout, or gets no slot within slot_timeout,
+        yields a timeout response instead of stalling the round
+        """
+        started = threading.Event()
+        
+        def work() -> Optional[Tuple[str, List[Dict]]]:
+            # 슬롯은 작업 스레드 안에서 잡고 SDK 호출이 실제로 끝날 때 반환
+            # (시간 초과로 결과를 버린 호출도 끝날 때까지 슬롯을 차지 → 동시 호출 수 제한 유지)
+            acquired = self._call_slots.acquire(timeout=self.slot_timeout)
+            started.set()
+            if not acquired:
+                return None
+            try:
+                return doc.think(context, question, True)
+            finally:
+                self._call_slots.release()
+        
+        future = executor.submit(work)
+        # 슬롯 대기 시간은 제외하고 호출이 시작된 시점부터 call_timeout 적용
+        started.wait()
+        try:
+            result = future.result(timeout=self.call_timeout)
+        except FuturesTimeoutError:
+            self._log.write(f"⚠️ {doc.name} timed out after {self.call_timeout:g}s")
+            return f"[Timeout: no response within {self.call_timeout:g}s]", []
+        if result is None:
+            self._log.write(f"⚠️ {doc.name} got no call slot within {self.slot_timeout:g}s")
+            return f"[Timeout: no free call slot within {self.slot_timeout:g}s]", []
+        return result
+    
+    def _run_group(self, idx: int, doc1: Doctor, doc2: Doctor, context: str,
+                   previous_feedback: str,
+                   executor: ThreadPoolExecutor) -> Tuple[Dict, List[Dict], str]:
+        """Run one circular group (doctor 1 → doctor 2)"""
+        question1 = self._first_opinion_question(doc2, previous_feedback)
+        opinion1, searches1 = self._think_limited(doc1, context, question1, executor)
+        
+        time.sleep(1)
+        
+        question2 = self._second_opinion_question(doc1, opinion1, previous_feedback)
+        opinion2, searches2 = self._think_limited(doc2, context, question2, executor)
+        
+        return self._group_result(idx, doc1, doc2, opinion1, searches1, opinion2, searches2)
+    
+    def _call_executor(self, calls: int) -> ThreadPoolExecutor:
+        # 시간 초과된 호출의 스레드가 남아 있어도 다음 호출이 대기열에 막히지 않도록 여유를 둠
+        return ThreadPoolExecutor(max_workers=max(calls, self.max_concurrency),
+                                  thread_name_prefix="doctor-call")
+    
+    def _gather_group_opinions(self, groups: List[Tuple[Doctor, Doctor]], context: str,
+                               previous_feedback: str) -> List[Tuple[Dict, List[Dict], str]]:
+        """
+        STAGE 1 for all groups at once
+        AI clients are blocking SDK calls, so each group runs in its own thread
+        and each call in a worker thread; wall time becomes the slowest group
+        instead of the sum of all groups. At most max_concurrency calls are in
+        flight, and a group that raises is skipped so it cannot cancel the rest
+        of the round.
+        Each group's output is written as soon as it finishes; the returned
+        list stays in group order.
+        """
+        executor = self._call_executor(2 * len(groups))
+        results: Dict[int, Any] = {}
+        try:
+            with ThreadPoolExecutor(max_workers=len(groups), thread_name_prefix="group") as pool:
+                futures = {
+                    pool.submit(self._run_group, idx, doc1, doc2, context, previous_feedback,
+                                executor): idx
+                    for idx, (doc1, doc2) in enumerate(groups, 1)
+                }
+                # 끝난 그룹부터 바로 출력 (가장 느린 그룹을 기다리지 않음)
+                for future in as_completed(futures):
+                    idx = futures[future]
+                    try:
+                        results[idx] = future.result()
+                    except Exception as e:
+                        results[idx] = e
+                        self._log.write(f"⚠️ Group {idx} failed, skipping this round: {e}")
+                    else:
+                        self._log.write(results[idx][2])
+        finally:
+            # 시간 초과로 남은 스레드를 기다리지 않음
+            executor.shutdown(wait=False)
+        
+        completed = [results[idx] for idx in sorted(results)
+                     if not isinstance(results[idx], Exception)]
+        if not completed:
+            # 모든 그룹이 실패하면 심판에게 넘길 의견이 없으므로 첫 오류를 그대로 전달
+            raise results[1]
+        return completed
+    
+    def _think_all(self, calls: List[Tuple[Doctor, str]],
+                   context: str) -> List[Tuple[str, List[Dict]]]:
+        """
+        Run independent doctor calls
+        Claude-backed calls are submitted as one Message Batch (50% token cost);
+        other providers, and any batch request that fails, run concurrently online
+        """
+        results: List[Optional[Tuple[str, List[Dict]]]] = [None] * len(calls)
+        
+        claude_indices = [i for i, (doc, _) in enumerate(calls)
+                          if isinstance(doc.ai_client, ClaudeClient)]
+        if claude_indices:
+            requests = []
+            for i in claude_indices:
+                doc, question = calls[i]
+                requests.append({
+                    "custom_id": f"call{i}",
+                    "params": doc.ai_client.build_params_with_context(
+                        doc.get_persona_prompt(), context, question,
+                        use_tools=True, max_tokens=DOCTOR_MAX_TOKENS
+                    )
+                })
+            try:
+                submitter = calls[claude_indices[0]][0].ai_client
+                batch_results = submitter.submit_batch(requests, self.batch_poll_interval)
+            except Exception as e:
+                self._log.write(f"⚠️ Message batch unavailable, falling back to concurrent calls: {e}")
+                batch_results = {}
+            for i in claude_indices:
+                results[i] = batch_results.get(f"call{i}")
+        
+        pending = [i for i, result in enumerate(results) if result is None]
+        if pending:
+            executor = self._call_executor(len(pending))
+            try:
+                with ThreadPoolExecutor(max_workers=len(pending),
+                                        thread_name_prefix="call-wait") as pool:
+                    futures = {
+                        pool.submit(self._think_limited, calls[i][0], context, calls[i][1],
+                                    executor): i
+                        for i in pending
+                    }
+                    for future in as_completed(futures):
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            # 클라이언트 오류 응답과 같은 형식으로 기록하여 그룹 구성은 유지
+                            result = (f"[Error: {e}]", [])
+                        results[futures[future]] = result
+            finally:
+                executor.shutdown(wait=False)
+        
+        return results
+    
+    def _gather_group_opinions_batch(self, groups: List[Tuple[Doctor, Doctor]], context: str,
+                                     previous_feedback: str) -> List[Tuple[Dict, List[Dict], str]]:
+        """
+        STAGE 1 via Message Batches: all first opinions in one batch,
+        then all second opinions (which depend on the first) in another
+        """
+        first = self._think_all([
+            (doc1, self._first_opinion_question(doc2, previous_feedback))
+            for doc1, doc2 in groups
+        ], context)
+        second = self._think_all([
+            (doc2, self._second_opinion_question(doc1, opinion1, previous_feedback))
+            for (doc1, doc2), (opinion1, _) in zip(groups, first)
+        ], context)
+        
+        results = [
+            self._group_result(idx, doc1, doc2, opinion1, searches1, opinion2, searches2)
+            for idx, ((doc1, doc2), (opinion1, searches1), (opinion2, searches2))
+            in enumerate(zip(groups, first, second), 1)
+        ]
+        for _, _, output in results:
+            self._log.write(output)
+        return results
+    
+    @staticmethod
+    def _format_opinions_for_referee(group_opinions: List[Dict]) -> str:
+        """
+        Render group opinions for the referee, sending each distinct opinion once
+        Identical opinions (converged answers, cached replays, the same provider
+        error) point back to their first occurrence instead of being repeated
+        """
+        first_seen: Dict[str, str] = {}
+        blocks = []
+        for op in group_opinions:
+            lines = [f"Group {op['group']} ({', '.join(op['models'])}):"]
+            for doctor, opinion in zip(op['doctors'], (op['opinion1'], op['opinion2'])):
+                shown = opinion[:800] + ("..." if len(opinion) > 800 else "")
+                digest = hashlib.md5(shown.encode("utf-8")).hexdigest()
+                if digest in first_seen:
+                    lines.append(f"Dr. {doctor}: [identical to {first_seen[digest]}]")
+                else:
+                    first_seen[digest] = f"Dr. {doctor} in Group {op['group']}"
+                    lines.append(f"Dr. {doctor}: {shown}")
+            blocks.append("\n".join(lines))
+        return "\n\n".join(blocks)
+    
+    @staticmethod
+    def _parse_consensus(referee_check: str) -> bool:
+        """
+        Read the referee's consensus verdict
+        The prompt requires {"consensus_reached": ...} alone on the last line,
+        so that line is decoded directly first; the regex/keyword scans below
+        only run when the referee didn't follow the format
+        """
+        last_line = referee_check.strip().rsplit("\n", 1)[-1].strip()
+        if last_line.startswith("{") and last_line.endswith("}"):
+            try:
+                verdict = _json_loads(last_line).get("consensus_reached")
+                if isinstance(verdict, bool):
+                    return verdict
+            except (ValueError, AttributeError):
+                pass
+        
+        consensus_reached = False
+        try:
+            # FIX: JSON 파싱 개선 - 다양한 형식 지원
+            # FIX #3: 마크다운 코드 블록 먼저 확인
+            code_block_match = _JSON_CODE_BLOCK_RE.search(referee_check)
+            
+            if code_block_match:
+                # 마크다운 코드 블록 내부의 JSON 사용
+                json_text = code_block_match.group(1).strip()
+            else:
+                # 코드 블록 없으면 전체 텍스트에서 검색
+                json_text = referee_check
+            
+            # JSON 블록 추출 (따옴표 여부와 무관하게)
+            json_match = _CONSENSUS_JSON_RE.search(json_text)
+            
+            if json_match:
+                json_str = json_match.group(0)
+                try:
+                    # 표준 JSON 파싱 시도
+                    data = _json_loads(json_str)
+                    consensus_reached = data.get("consensus_reached", False)
+                except json.JSONDecodeError:
+                    # JSON 파싱 실패 시 정규식으로 true/false 추출
+                    value_match = _BOOL_RE.search(json_str)
+                    if value_match:
+                        consensus_reached = value_match.group(1).lower() == "true"
+            else:
+                # JSON 없으면 fallback: 부정형 먼저 체크 후 긍정형 체크
+                lower_check = referee_check.lower()
+                # 부정형 패턴 먼저 확인
+                negatives_en = ["not reached", "not yet reached", "not achieved",
+                                "no consensus", "has not been reached", "consensus is not"]
+                negatives_kr = ["도달하지 못", "합의되지 않", "합의 안", "아직 합의"]
+                
+                is_negative = any(neg in lower_check for neg in negatives_en) or \
+                              any(neg in referee_check for neg in negatives_kr)
+                
+                if not is_negative:
+                    # 부정형 없는 경우에만 긍정형 확인
+                    positives_en = ["consensus reached", "consensus achieved",
+                                    "consensus has been reached", "reached consensus"]
+                    positives_kr = ["합의에 도달", "합의가 달성", "합의 도달"]
+                    
+                    is_positive = any(pos in lower_check for pos in positives_en) or \
+                                  any(pos in referee_check for pos in positives_kr)
+                    
+                    consensus_reached = is_positive
+        except Exception:
+            consensus_reached = False
+        
+        return consensus_reached
+    
     def _conduct_debate(self, patient: Patient, groups: List[Tuple[Doctor, Doctor]], 
                        max_rounds: int) -> Dict:
         """
@@ -1322,16 +2381,44 @@ Patient Information:
 - Medical History: {patient.history}
 - Current Medications: {', '.join(patient.current_medications) if patient.current_medications else 'None'}
 - Known Allergies: {', '.join(patient.allergies) if patient.allergies else 'None'}
+"""
+        
+        # 심판 지침은 토론 내내 변하지 않으므로 환자 정보와 함께 고정 접두사로 한 번만 구성
+        # (리셋 안내, 이전 판단, 그룹 의견 등 라운드마다 바뀌는 내용은 질문 뒤쪽에 배치)
+        referee_context = f"""{context}
+Your tasks for each round:
+1. Identify medically unsupported claims
+2. Detect hallucinations (non-existent drugs, treatments, etc.)
+3. Use web search to fact-check each diagnosis
+4. Point out missed differential diagnoses
+
+⚕️ MANDATORY drug verification steps - do these FIRST:
+- Search: "[each medication the patient takes] side effects"
+- Search: "[medication A] [medication B] drug interaction"
+- Check: Could any current symptom be caused by a medication?
+- Check: Is any diagnosis actually a drug side effect being misidentified?
+
+Use the patient information above for drug checks.
+Use web search to verify latest diagnostic criteria AND drug information.
 """
         
         all_diagnoses = []
-        all_searches = []
-        previous_rounds = []  # 이전 라운드 토론 누적 저장소
+        total_searches = 0  # 검색 횟수만 결과에 쓰이므로 검색 기록 자체는 누적하지 않음
+        failed_calls = 0  # 전체 라운드의 실패한 호출 수 (오류 응답, 누락된 그룹, 심판 오류)
+        self.debate_history.clear()
+        # 의사용 피드백은 직전 라운드만 참조하므로 전체 라운드를 누적하지 않고 마지막 기록만 유지
+        # (라운드 수에 비례해 메모리가 늘어나지 않음; 심판별 기록은 referee.memory)
+        last_round: Optional[Dict] = None
+        
+        # GPT/Grok의 클라이언트 측 웹 검색은 토론 전체에서 공유 (같은 쿼리를 의사마다 반복 검색하지 않음)
+        self.search_broker = SearchBroker()
+        for agent in self.doctors + self.referees:
+            agent.ai_client.search_broker = self.search_broker
         
         for round_num in range(1, max_rounds + 1):
-            print(f"\n{'='*80}")
-            print(f"Round {round_num}")
-            print(f"{'='*80}\n")
+            self._log.write(f"\n{'='*80}")
+            self._log.write(f"Round {round_num}")
+            self._log.write(f"{'='*80}\n")
             
             self.current_round = round_num
             
@@ -1347,14 +2434,13 @@ Patient Information:
             
             # Get active referee for this round
             active_referee = self.get_active_referee(round_num)
-            print(f"⚖️ Active referee: {active_referee}\n")
+            self._log.write(f"⚖️ Active referee: {active_referee}\n")
             
             # --- 이전 라운드 심판 피드백 구성 (의사용) ---
             # 의사는 항상 이전 라운드의 심판 피드백을 받음 (학습용)
             # FIX V3: 리셋된 라운드는 [RESET_FRESH_VOICE] 태그 추가
             previous_feedback_for_doctors = ""
-            if previous_rounds:
-                last_round = previous_rounds[-1]
+            if last_round is not None:
                 referee_name = last_round.get('referee_name', 'Unknown')
                 was_reset = last_round.get('was_reset', False)
                 status = last_round.get('status', 'VALID')
@@ -1420,74 +2506,28 @@ Do NOT penalize for lack of previous context - focus on current evidence.
                 previous_context_for_referee = f"\n--- Your Previous Judgments (for continuity) ---\n{previous_context_for_referee}\n--- End Previous ---\n"
             
             # STAGE 1: OPINION
-            print("📝 STAGE 1: OPINION\n")
+            self._log.write("📝 STAGE 1: OPINION\n")
             
+            # 그룹들은 서로 독립적이므로 동시에 실행 (그룹 내 의사 1 → 의사 2 순서는 유지)
+            if self.use_batch:
+                stage1 = self._gather_group_opinions_batch(groups, context, previous_feedback_for_doctors)
+            else:
+                stage1 = self._gather_group_opinions(groups, context, previous_feedback_for_doctors)
+            
+            # 그룹별 출력은 각 단계 함수가 완료 시점에 이미 기록함
             group_opinions = []
-            for idx, (doc1, doc2) in enumerate(groups, 1):
-                print(f"--- Group {idx}: {doc1.name} ({doc1.ai_client.get_model_name()}) + "
-                      f"{doc2.name} ({doc2.ai_client.get_model_name()}) ---")
-                
-                # Doctor 1 opinion — 이전 심판 피드백 포함
-                question1 = f"""
-{previous_feedback_for_doctors}
-Analyze this patient's symptoms and provide possible diagnoses.
-If rare or complex, use web search for latest information.
-You will discuss with Dr. {doc2.name}, so provide clear evidence.
-"""
-                opinion1, searches1 = doc1.think(context, question1, use_web_search=True)
-                all_searches.extend(searches1)
-                
-                print(f"\n[{doc1.name} - {doc1.ai_client.get_model_name()}]")
-                if searches1:
-                    for s in searches1:
-                        print(f"  🔍 Search: {s['query']}")
-                display1 = opinion1[:500] + ("..." if len(opinion1) > 500 else "")
-                print(f"{display1}\n")
-                
-                time.sleep(1)
-                
-                # Doctor 2 opinion
-                question2 = f"""
-{previous_feedback_for_doctors}
-Dr. {doc1.name} provided this opinion:
-
-{opinion1}
-
-As an independent doctor, provide your own opinion.
-You may agree or disagree with Dr. {doc1.name}.
-Use web search for latest information.
-"""
-                opinion2, searches2 = doc2.think(context, question2, use_web_search=True)
-                all_searches.extend(searches2)
-                
-                print(f"[{doc2.name} - {doc2.ai_client.get_model_name()}]")
-                if searches2:
-                    for s in searches2:
-                        print(f"  🔍 Search: {s['query']}")
-                display2 = opinion2[:500] + ("..." if len(opinion2) > 500 else "")
-                print(f"{display2}\n")
-                
-                time.sleep(1)
-                
-                group_opinions.append({
-                    "group": idx,
-                    "doctors": [doc1.name, doc2.name],
-                    "models": [doc1.ai_client.get_model_name(), doc2.ai_client.get_model_name()],
-                    "opinion1": opinion1,
-                    "opinion2": opinion2
-                })
+            for group_opinion, searches, _ in stage1:
+                group_opinions.append(group_opinion)
+                total_searches += len(searches)
+                failed_calls += sum(1 for key in ("opinion1", "opinion2")
+                                    if _FAILED_RESPONSE_RE.match(group_opinion[key]))
+            # 실패로 제외된 그룹
+            failed_calls += len(groups) - len(stage1)
             
             # STAGE 2: REFEREE CHECK
-            print(f"\n⚖️ STAGE 2: REFEREE CHECK - {active_referee.name}\n")
+            self._log.write(f"\n⚖️ STAGE 2: REFEREE CHECK - {active_referee.name}\n")
             
-            all_opinions_text = "\n\n".join([
-                f"Group {op['group']} ({', '.join(op['models'])}):\n"
-                f"Dr. {op['doctors'][0]}: {op['opinion1'][:800]}"
-                + ("..." if len(op['opinion1']) > 800 else "") + "\n"
-                f"Dr. {op['doctors'][1]}: {op['opinion2'][:800]}"
-                + ("..." if len(op['opinion2']) > 800 else "")
-                for op in group_opinions
-            ])
+            all_opinions_text = self._format_opinions_for_referee(group_opinions)
             
             referee_question = f"""
 {reset_instruction}{previous_context_for_referee}
@@ -1495,106 +2535,39 @@ Review each group's diagnostic opinions:
 
 {all_opinions_text}
 
-Your tasks:
-1. Identify medically unsupported claims
-2. Detect hallucinations (non-existent drugs, treatments, etc.)
-3. Use web search to fact-check each diagnosis
-4. Point out missed differential diagnoses
-
-⚕️ MANDATORY drug verification steps - do these FIRST:
-- Search: "[each medication the patient takes] side effects"
-- Search: "[medication A] [medication B] drug interaction"
-- Check: Could any current symptom be caused by a medication?
-- Check: Is any diagnosis actually a drug side effect being misidentified?
-
-Patient context for drug checks:
-{context}
-
-Use web search to verify latest diagnostic criteria AND drug information.
-
 At the end, output EXACTLY this JSON on a single line (no extra text after it):
 {{"consensus_reached": true}}  if consensus IS reached
 {{"consensus_reached": false}} if consensus is NOT reached
 Do not add any explanation or text after the JSON line.
 """
             
-            referee_check, ref_searches = active_referee.evaluate(context, referee_question)
-            all_searches.extend(ref_searches)
+            # 심판 호출도 호출 슬롯을 사용 (diagnose_batch에서 여러 토론의 심판이 동시에 호출될 수 있음)
+            if self._call_slots.acquire(timeout=self.slot_timeout):
+                try:
+                    referee_check, ref_searches = active_referee.evaluate(referee_context, referee_question)
+                finally:
+                    self._call_slots.release()
+            else:
+                self._log.write(f"⚠️ {active_referee.name} got no call slot within {self.slot_timeout:g}s")
+                referee_check, ref_searches = f"[Timeout: no free call slot within {self.slot_timeout:g}s]", []
+            total_searches += len(ref_searches)
+            if _FAILED_RESPONSE_RE.match(referee_check):
+                failed_calls += 1
             
-            print(f"[{active_referee.name} - {active_referee.ai_client.get_model_name()}]")
+            self._log.write(f"[{active_referee.name} - {active_referee.ai_client.get_model_name()}]")
             if ref_searches:
                 for s in ref_searches:
-                    print(f"  🔍 Search: {s['query']}")
+                    self._log.write(f"  🔍 Search: {s['query']}")
             display_ref = referee_check[:500] + ("..." if len(referee_check) > 500 else "")
-            print(f"{display_ref}\n")
+            self._log.write(f"{display_ref}\n")
             
             time.sleep(1)
             
             # --- 종료 조건: JSON 파싱으로 합의 판별 ---
-            consensus_reached = False
-            try:
-                # FIX: JSON 파싱 개선 - 다양한 형식 지원
-                import re as re_module
-                import json as json_module
-                
-                # FIX #3: 마크다운 코드 블록 먼저 확인
-                code_block_match = re_module.search(
-                    r'```json\s*\n(.*?)\n```', 
-                    referee_check, 
-                    re_module.DOTALL | re_module.IGNORECASE
-                )
-                
-                if code_block_match:
-                    # 마크다운 코드 블록 내부의 JSON 사용
-                    json_text = code_block_match.group(1).strip()
-                else:
-                    # 코드 블록 없으면 전체 텍스트에서 검색
-                    json_text = referee_check
-                
-                # JSON 블록 추출 (따옴표 여부와 무관하게)
-                json_match = re_module.search(
-                    r'\{[^}]*["\']?consensus_reached["\']?\s*:\s*(true|false)[^}]*\}',
-                    json_text,
-                    re_module.IGNORECASE
-                )
-                
-                if json_match:
-                    json_str = json_match.group(0)
-                    try:
-                        # 표준 JSON 파싱 시도
-                        data = json_module.loads(json_str)
-                        consensus_reached = data.get("consensus_reached", False)
-                    except json_module.JSONDecodeError:
-                        # JSON 파싱 실패 시 정규식으로 true/false 추출
-                        value_match = re_module.search(r'(true|false)', json_str, re_module.IGNORECASE)
-                        if value_match:
-                            consensus_reached = value_match.group(1).lower() == "true"
-                else:
-                    # JSON 없으면 fallback: 부정형 먼저 체크 후 긍정형 체크
-                    lower_check = referee_check.lower()
-                    # 부정형 패턴 먼저 확인
-                    negatives_en = ["not reached", "not yet reached", "not achieved",
-                                    "no consensus", "has not been reached", "consensus is not"]
-                    negatives_kr = ["도달하지 못", "합의되지 않", "합의 안", "아직 합의"]
-                    
-                    is_negative = any(neg in lower_check for neg in negatives_en) or \
-                                  any(neg in referee_check for neg in negatives_kr)
-                    
-                    if not is_negative:
-                        # 부정형 없는 경우에만 긍정형 확인
-                        positives_en = ["consensus reached", "consensus achieved",
-                                        "consensus has been reached", "reached consensus"]
-                        positives_kr = ["합의에 도달", "합의가 달성", "합의 도달"]
-                        
-                        is_positive = any(pos in lower_check for pos in positives_en) or \
-                                      any(pos in referee_check for pos in positives_kr)
-                        
-                        consensus_reached = is_positive
-            except Exception:
-                consensus_reached = False
+            consensus_reached = self._parse_consensus(referee_check)
             
             # --- 현재 라운드 데이터를 활성 심판의 메모리에 저장 ---
-            # FIX: previous_rounds 전역 리스트 대신 심판별 독립 메모리 사용
+            # FIX: 전역 라운드 기록 대신 심판별 독립 메모리 사용
             # FIX V3: 리셋 여부도 기록하여 나중에 참조 시 무효화 가능
             diagnoses_summary = ", ".join([
                 f"Group {op['group']}: {op['opinion1'][:150]}"
@@ -1613,9 +2586,8 @@ Do not add any explanation or text after the JSON line.
                 "was_reset": was_reset  # FIX V3: 리셋 여부 기록
             })
             
-            # previous_rounds는 디버깅/출력용으로만 유지
             # FIX V3: 리셋 정보 포함 및 INVALIDATED 마킹
-            round_record = {
+            last_round = {
                 "round": round_num,
                 "referee_name": active_referee.name,
                 "diagnoses_summary": diagnoses_summary,
@@ -1624,30 +2596,33 @@ Do not add any explanation or text after the JSON line.
                 "was_reset": was_reset,
                 "status": "INVALIDATED_RESET" if was_reset else "VALID"  # 리셋 시 무효화 마킹
             }
-            previous_rounds.append(round_record)
+            self.debate_history.append(last_round)
             
             # --- 종료 판정 ---
             if consensus_reached:
                 if self.language == 'ko':
-                    print("\n✅ 합의 도달! 진단 완료.\n")
+                    self._log.write("\n✅ 합의 도달! 진단 완료.\n")
                 else:
-                    print("\n✅ Consensus reached! Diagnosis complete.\n")
+                    self._log.write("\n✅ Consensus reached! Diagnosis complete.\n")
                 break
             
             if round_num >= max_rounds:
                 if self.language == 'ko':
-                    print("\n⚠️ 최대 라운드 도달. 현재까지의 의견을 출력합니다.\n")
+                    self._log.write("\n⚠️ 최대 라운드 도달. 현재까지의 의견을 출력합니다.\n")
                 else:
-                    print("\n⚠️ Max rounds reached. Outputting current opinions.\n")
+                    self._log.write("\n⚠️ Max rounds reached. Outputting current opinions.\n")
                 break
             
             # Simplified STAGE 3-5 for brevity
-            print(f"[Stages 3-5 abbreviated for demo]\n")
+            self._log.write(f"[Stages 3-5 abbreviated for demo]\n")
+        
+        self._log.flush()
         
         result = {
             "patient": patient,
             "diagnoses": group_opinions,
-            "total_searches": len(all_searches),
+            "total_searches": total_searches,
+            "failed_calls": failed_calls,
             "rounds": round_num,
             "ai_models_used": list(set([doc.ai_client.get_model_name() for doc in self.doctors])),
             "referee_resets": sum([1 for r in range(1, round_num+1) 
@@ -1661,6 +2636,9 @@ Do not add any explanation or text after the JSON line.
 def example_usage():
     """Example usage of the Multi-AI Diagnosis System"""
     
+    # 사용자가 언어를 고르는 동안 SDK를 백그라운드에서 미리 로드
+    threading.Thread(target=_preload_sdks, name="sdk-preload", daemon=True).start()
+    
     # Language selection
     print("\n🌐 Select Language / 언어 선택:")
     print("  1. English")
@@ -1739,28 +2717,35 @@ def example_usage():
         )
     
     # Run diagnosis
-    result = system.diagnose(patient, max_rounds=3)
-    
-    # Print results
-    print("\n" + "="*80)
-    if language == 'ko':
-        print("진단 결과")
-    else:
-        print("DIAGNOSIS RESULTS")
-    print("="*80)
+    try:
+        result = system.diagnose(patient, max_rounds=3)
+    finally:
+        system.close()
     
+    # Print results (한 번에 출력)
     if language == 'ko':
-        print(f"\n실제 질환: {', '.join(patient.actual_diseases)}")
-        print(f"라운드: {result['rounds']}")
-        print(f"총 검색: {result['total_searches']}")
-        print(f"사용된 AI 모델: {', '.join(result['ai_models_used'])}")
-        print(f"심판 초기화: {result['referee_resets']}회")
+        lines = [
+            "\n" + "="*80,
+            "진단 결과",
+            "="*80,
+            f"\n실제 질환: {', '.join(patient.actual_diseases)}",
+            f"라운드: {result['rounds']}",
+            f"총 검색: {result['total_searches']}",
+            f"사용된 AI 모델: {', '.join(result['ai_models_used'])}",
+            f"심판 초기화: {result['referee_resets']}회",
+        ]
     else:
-        print(f"\nActual diseases: {', '.join(patient.actual_diseases)}")
-        print(f"Rounds: {result['rounds']}")
-        print(f"Total searches: {result['total_searches']}")
-        print(f"AI models used: {', '.join(result['ai_models_used'])}")
-        print(f"Referee resets: {result['referee_resets']}")
+        lines = [
+            "\n" + "="*80,
+            "DIAGNOSIS RESULTS",
+            "="*80,
+            f"\nActual diseases: {', '.join(patient.actual_diseases)}",
+            f"Rounds: {result['rounds']}",
+            f"Total searches: {result['total_searches']}",
+            f"AI models used: {', '.join(result['ai_models_used'])}",
+            f"Referee resets: {result['referee_resets']}",
+        ]
+    print("\n".join(lines))
 
 
 if __name__ == "__main__":